@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from twizzle import TestRunner, Cache
 import example_wrapper as wrapper
+from pih_presets.hash_pipeline import precompute_hashes
 import numpy as np
 
 # global config
@@ -10,24 +11,34 @@ NR_OF_THREADS = 10
 if __name__ == "__main__":
     sDBPath = "test.db"
 
-    oRunner = TestRunner(sDBPath, lNrOfThreads=NR_OF_THREADS)
+    # tests already in the database (e.g. of an interrupted earlier run) are skipped
+    oRunner = TestRunner(sDBPath, lNrOfThreads=NR_OF_THREADS, bResume=True)
     # create cache
     # here we use a persistent cache because we have to
     oTwizzlePersistentCache = Cache(
         bPersistent=True, sPathToPersistenceDB="twizzle_cache.db")
 
-    # iterate over thresholds
-    for lThreshold in np.arange(0.1, 0.3, 0.1):
-        # iterate over hash sizes
-        for lHashSize in [8, 16, 32]:
-            # add test to testrunner
-            oRunner.run_test_async("image_hashing_challenge_print_scan_1", wrapper.test_aHash, {
-                                   "lThreshold": lThreshold, "lHashSize": lHashSize, "oCache": oTwizzlePersistentCache})
-            oRunner.run_test_async("image_hashing_challenge_print_scan_1", wrapper.test_dHash, {
-                                   "lThreshold": lThreshold, "lHashSize": lHashSize, "oCache": oTwizzlePersistentCache})
-            # # NOTE: for better understanding, this is what
-            # # we do here if we would not use threads
-            # pm.run_test("printscan_printer1", test_dhash, {"lThreshold":
-            # lThreshold, "lHashSize": lHashSize})
+    # thresholds to evaluate -- the wrappers return raw deviations (lThreshold=None)
+    # and all thresholds are evaluated on them in a single run of the algorithm
+    aThresholds = np.arange(0.1, 0.3, 0.1)
+
+    # decode every image of the challenge only once and calculate all hashes the
+    # tests below need in one visit, the wrappers find them in the cache
+    dicChallenge = oRunner.tw.get_challenge("image_hashing_challenge_print_scan_1")
+    aHashSpecs = [(sAlgorithm, lHashSize) for sAlgorithm in ["aHash", "dHash"]
+                  for lHashSize in [8, 16, 32]]
+    precompute_hashes(list(dicChallenge["originalObjects"]) + list(dicChallenge["comparativeObjects"]),
+                      aHashSpecs, oTwizzlePersistentCache)
+
+    # sweep over hash sizes and thresholds -- the hashes are calculated once per
+    # hash size, every threshold is saved as test of its own
+    dicGrid = {"lHashSize": [8, 16, 32], "lThreshold": aThresholds}
+    for fnCallback in [wrapper.test_aHash, wrapper.test_dHash]:
+        oRunner.sweep(["image_hashing_challenge_print_scan_1"], fnCallback, dicGrid,
+                      {"oCache": oTwizzlePersistentCache})
+        # # NOTE: for better understanding, this is what
+        # # the sweep does for every hash size
+        # oRunner.run_test_async("image_hashing_challenge_print_scan_1", fnCallback, {
+        #     "lThreshold": None, "lHashSize": lHashSize, "oCache": oTwizzlePersistentCache}, aThresholds=aThresholds)
 
     oRunner.wait_till_tests_finished()
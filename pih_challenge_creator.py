@@ -20,12 +20,10 @@ climenu.settings.back_values = ['']
 
 # helper functions
 def show_challenges_helper(bShowIndex=False):
-    aChallenges = tw.get_challenges()
+    aChallenges = tw.get_challenge_summaries()
     if len(aChallenges) == 0:
         return []
     dfChallenges = pd.DataFrame(aChallenges)
-    dfChallenges["challenge_set_size"] = dfChallenges.apply(
-        lambda row: len(row["targetDecisions"]), axis=1)
     print(tabulate(dfChallenges[["challenge", "challenge_set_size"]], headers='keys',
                    tablefmt='psql', showindex="never" if not bShowIndex else "always"))
     return dfChallenges["challenge"].tolist()
@@ -34,7 +32,7 @@ def show_challenges_helper(bShowIndex=False):
 def get_challenge_name():
     # check list of challenges already defined
     challengeNamesAlreadyDefined = [
-        challengeObject["challenge"] for challengeObject in tw.get_challenges()]
+        challengeObject["challenge"] for challengeObject in tw.get_challenge_summaries()]
 
     # get name of challenge
     print('\nSpecify a name of the challenge:')
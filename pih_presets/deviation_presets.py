@@ -3,10 +3,172 @@
 This module defines common functions to calculate the deviation between two hashes
 """
 import numpy as np
+from pih_presets.packed_hash import PackedHash, pack_hash, popcount
 
 
 def hamming_distance(array1, array2):
+    """normalized hamming distance of two hashes given as arrays of bits or as packed hashes"""
+    if isinstance(array1, PackedHash) or isinstance(array2, PackedHash):
+        if not isinstance(array1, PackedHash):
+            array1 = pack_hash(np.ravel(array1))
+        if not isinstance(array2, PackedHash):
+            array2 = pack_hash(np.ravel(array2))
+        if (array1.bits != array2.bits):
+            raise Exception("Arrays have to have the same size")
+        # padding bits are zero in both hashes and do not count
+        return int(popcount(np.bitwise_xor(array1.words, array2.words)).sum()) / array1.bits
     if (array1.size != array2.size):
         raise Exception("Arrays have to have the same size")
     hamming = array1 != array2
     return np.count_nonzero(hamming) / hamming.size
+
+
+def _get_packed_words(oHashes, lBits=None):
+    """ returns the hashes as uint64 words and the number of bits of a hash
+
+    Args:
+        oHashes: :obj:`PackedHash` or uint8 array of packed bits (see numpy.packbits)
+        lBits (int): number of bits of a hash, only needed for arrays whose hashes do not fill whole bytes
+    """
+    if isinstance(oHashes, PackedHash):
+        return oHashes.as_uint64(), oHashes.bits
+    aWords = np.asarray(oHashes, dtype=np.uint8)
+    if lBits is None:
+        lBits = aWords.shape[-1] * 8
+    return PackedHash(aWords, lBits).as_uint64(), lBits
+
+
+def hamming_distances(aHashes1, aHashes2, lBits=None):
+    """ normalized hamming distances of aligned pairs of packed hashes (aHashes1[i] vs aHashes2[i])
+
+    Note:
+        All N distances are calculated in one call by counting the bits set in the XOR of the hashes.
+
+    Args:
+        aHashes1: stack of N hashes as :obj:`PackedHash` or uint8 array of shape (N, words)
+        aHashes2: stack of N hashes as :obj:`PackedHash` or uint8 array of shape (N, words)
+        lBits (int): number of bits of a hash (default: all bits of the words)
+
+    Returns:
+        :obj:`numpy.ndarray`: float array holding the N distances
+    """
+    aWords1, lBits1 = _get_packed_words(aHashes1, lBits)
+    aWords2, lBits2 = _get_packed_words(aHashes2, lBits)
+    if (lBits1 != lBits2 or aWords1.shape != aWords2.shape):
+        raise Exception("Arrays have to have the same size")
+    aCounts = popcount(np.bitwise_xor(aWords1, aWords2)).sum(axis=-1)
+    return aCounts / lBits1
+
+
+def hamming_distances_to_many(oHash, aHashes, lBits=None):
+    """ normalized hamming distances of one packed hash to each of a stack of packed hashes
+
+    Args:
+        oHash: single hash as :obj:`PackedHash` or uint8 array of shape (words,)
+        aHashes: stack of N hashes as :obj:`PackedHash` or uint8 array of shape (N, words)
+        lBits (int): number of bits of a hash (default: all bits of the words)
+
+    Returns:
+        :obj:`numpy.ndarray`: float array holding the N distances
+    """
+    aWords, lBits1 = _get_packed_words(oHash, lBits)
+    aManyWords, lBits2 = _get_packed_words(aHashes, lBits)
+    if (lBits1 != lBits2 or aWords.shape[-1] != aManyWords.shape[-1]):
+        raise Exception("Arrays have to have the same size")
+    aCounts = popcount(np.bitwise_xor(aManyWords, aWords)).sum(axis=-1)
+    return aCounts / lBits1
+
+
+def _merge_nearest(aNearestCounts, aNearestIndices, aBlockCounts, aBlockIndices, lTopK):
+    """ merges the nearest lists of some rows with the distances of a new block of columns"""
+    aCandidateCounts = np.concatenate([aNearestCounts, aBlockCounts], axis=1)
+    aCandidateIndices = np.concatenate(
+        [aNearestIndices, np.broadcast_to(aBlockIndices, aBlockCounts.shape)], axis=1)
+    aSelection = np.argpartition(aCandidateCounts, lTopK - 1, axis=1)[:, :lTopK]
+    return (np.take_along_axis(aCandidateCounts, aSelection, axis=1),
+            np.take_along_axis(aCandidateIndices, aSelection, axis=1))
+
+
+def calc_all_pairs_statistics(oHashes, oOtherHashes=None, lTopK=0, lBlockSize=1024, lBits=None):
+    """ compares every packed hash to every other one and collects distance statistics
+
+    Note:
+        The distance matrix is calculated tile by tile (lBlockSize x lBlockSize pairs at a time)
+        and never held in memory as a whole. For every tile the histogram of the distances and
+        the lists of nearest hashes are updated.
+        Without oOtherHashes every unordered pair of distinct hashes of oHashes is counted once
+        and a hash is never its own nearest neighbour. With oOtherHashes every hash of oHashes is
+        compared to every hash of oOtherHashes.
+
+    Args:
+        oHashes: stack of N hashes as :obj:`PackedHash` or uint8 array of shape (N, words)
+        oOtherHashes: optional stack of M hashes to compare to (default: oHashes itself)
+        lTopK (int): number of nearest hashes to find for every hash of oHashes (0 to skip)
+        lBlockSize (int): number of rows and columns of a tile, bounds the memory needed
+        lBits (int): number of bits of a hash (default: all bits of the words)
+
+    Returns:
+        :obj:: dictionary holding
+            `histogram`: number of pairs for every distance of 0 to bits differing bits
+            `distances`: normalized hamming distance belonging to each bin of the histogram
+            `nearest_indices`: (N, lTopK) indices of the nearest hashes, ordered by distance
+            `nearest_distances`: (N, lTopK) normalized distances of the nearest hashes
+    """
+    aWords, lBits1 = _get_packed_words(oHashes, lBits)
+    bSelf = oOtherHashes is None
+    if bSelf:
+        aOtherWords, lBits2 = aWords, lBits1
+    else:
+        aOtherWords, lBits2 = _get_packed_words(oOtherHashes, lBits)
+    if (lBits1 != lBits2 or aWords.shape[-1] != aOtherWords.shape[-1]):
+        raise Exception("Arrays have to have the same size")
+    if lBlockSize < 1:
+        raise ValueError("Block size must be positive")
+
+    lRows, lColumns = aWords.shape[0], aOtherWords.shape[0]
+    lTopK = min(lTopK, lColumns - 1 if bSelf else lColumns)
+    aHistogram = np.zeros(lBits1 + 1, dtype=np.int64)
+    # counts above lBits mark empty slots of the nearest lists
+    aNearestCounts = np.full((lRows, max(lTopK, 0)), lBits1 + 1, dtype=np.int64)
+    aNearestIndices = np.full((lRows, max(lTopK, 0)), -1, dtype=np.int64)
+
+    for lRowStart in range(0, lRows, lBlockSize):
+        aRowWords = aWords[lRowStart:lRowStart + lBlockSize]
+        lRowEnd = lRowStart + aRowWords.shape[0]
+        # by symmetry only tiles on or above the diagonal are needed when comparing to itself
+        lFirstColumn = lRowStart if bSelf else 0
+        for lColumnStart in range(lFirstColumn, lColumns, lBlockSize):
+            aColumnWords = aOtherWords[lColumnStart:lColumnStart + lBlockSize]
+            lColumnEnd = lColumnStart + aColumnWords.shape[0]
+            aCounts = popcount(np.bitwise_xor(
+                aRowWords[:, None, :], aColumnWords[None, :, :])).sum(axis=-1, dtype=np.int64)
+
+            bDiagonal = bSelf and lColumnStart == lRowStart
+            if bDiagonal:
+                aHistogram += np.bincount(aCounts[np.triu_indices(aCounts.shape[0], k=1)],
+                                          minlength=lBits1 + 1)
+                # a hash is not its own neighbour
+                np.fill_diagonal(aCounts, lBits1 + 1)
+            else:
+                aHistogram += np.bincount(aCounts.ravel(), minlength=lBits1 + 1)
+
+            if lTopK > 0:
+                aNearestCounts[lRowStart:lRowEnd], aNearestIndices[lRowStart:lRowEnd] = _merge_nearest(
+                    aNearestCounts[lRowStart:lRowEnd], aNearestIndices[lRowStart:lRowEnd],
+                    aCounts, np.arange(lColumnStart, lColumnEnd), lTopK)
+                if bSelf and not bDiagonal:
+                    # the transposed tile holds the distances of the column hashes
+                    aNearestCounts[lColumnStart:lColumnEnd], aNearestIndices[lColumnStart:lColumnEnd] = _merge_nearest(
+                        aNearestCounts[lColumnStart:lColumnEnd], aNearestIndices[lColumnStart:lColumnEnd],
+                        aCounts.T, np.arange(lRowStart, lRowEnd), lTopK)
+
+    if lTopK > 0:
+        # order the nearest lists by distance (ties by index)
+        aOrder = np.lexsort((aNearestIndices, aNearestCounts), axis=-1)
+        aNearestCounts = np.take_along_axis(aNearestCounts, aOrder, axis=1)
+        aNearestIndices = np.take_along_axis(aNearestIndices, aOrder, axis=1)
+
+    return {"histogram": aHistogram,
+            "distances": np.arange(lBits1 + 1) / lBits1,
+            "nearest_indices": aNearestIndices,
+            "nearest_distances": aNearestCounts / lBits1}
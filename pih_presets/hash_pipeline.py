@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+This module defines a hashing stage that calculates several hashes of an image in one visit.
+Every image is decoded only once, no matter how many algorithms and hash sizes are requested.
+"""
+from pih_presets.utils import load_image, load_image_sizes, iter_images, REDUCED_DECODE_TAG
+from pih_presets.hashalgos_preset import aHash, dHash, pHash, get_min_image_size
+
+# hash functions the specs of precompute_hashes can refer to
+HASH_FUNCTIONS = {"aHash": aHash,
+                  "dHash": dHash,
+                  "pHash": pHash}
+
+# number of images whose hashes are looked up in and written to the cache at once
+BATCH_SIZE = 1000
+
+
+def calc_hashes(aImage, aHashSpecs):
+    """ calculates several packed hashes of an already decoded image
+
+    Args:
+        aImage (:obj:`numpy.ndarray`): the decoded image
+        aHashSpecs (:obj:`list` of :obj:`tuple`): specs of the hashes to calculate, every spec is the name
+                                                 of the algorithm followed by its positional parameters,
+                                                 e.g. ("aHash", 16) or ("pHash", 8, 4)
+
+    Returns:
+        :obj:`list` of :obj:`PackedHash`: the hashes in the order of the specs
+    """
+    return [HASH_FUNCTIONS[oSpec[0]](aImage, *oSpec[1:], bPacked=True) for oSpec in aHashSpecs]
+
+
+def precompute_hashes(aImagePaths, aHashSpecs, oCache=None, bReducedDecode=False, lNrOfThreads=4):
+    """ calculates the hashes of many images for several algorithms and sizes, decoding every image once
+
+    Note:
+        The hashes are written to the cache under the key calc_file_key(path, *spec), which is the key the
+        wrappers of example_wrapper.py look them up with. Images whose hashes are all cached already are
+        not decoded at all.
+        With bReducedDecode the images are decoded to grayscale at the lowest resolution a hash
+        needs (see utils.load_image), once per resolution needed, and REDUCED_DECODE_TAG is added
+        to the keys, like the wrappers do with bReducedDecode=True.
+
+    Args:
+        aImagePaths (:obj:`list` of :obj:`str`): paths of the images, duplicates are hashed once
+        aHashSpecs (:obj:`list` of :obj:`tuple`): specs of the hashes (see calc_hashes)
+        oCache (:obj:`Cache`): cache to look up and store the hashes (optional)
+        bReducedDecode (bool): decode the images at reduced resolution
+        lNrOfThreads (int): number of threads decoding images ahead of the hashing (see utils.iter_images)
+
+    Returns:
+        :obj:: dictionary mapping every spec to the list of hashes of aImagePaths
+    """
+    aHashSpecs = [tuple(oSpec) for oSpec in aHashSpecs]
+    for oSpec in aHashSpecs:
+        if oSpec[0] not in HASH_FUNCTIONS:
+            raise Exception("Unknown hash algorithm %s" % oSpec[0])
+    aKeySuffix = [REDUCED_DECODE_TAG] if bReducedDecode else []
+
+    def fnLoad(sPath, aMissing):
+        """decode an image once (or once per needed resolution), returns the images and the specs to calculate"""
+        if not bReducedDecode:
+            return [(load_image(sPath), aMissing)]
+        # the resolution depends on the size a hash needs, so the hashes are the same as if calculated
+        # by the wrappers. Every resolution is decoded once, specs needing the same one are grouped.
+        aImages = load_image_sizes(sPath, [get_min_image_size(*aHashSpecs[j]) for j in aMissing], bGrayscale=True)
+        dicDecodes = {}
+        for aImage, j in zip(aImages, aMissing):
+            dicDecodes.setdefault(id(aImage), (aImage, []))[1].append(j)
+        return list(dicDecodes.values())
+
+    def fnCompute(aPaths, aPositions):
+        """calculates the hashes at the given positions of the table of paths and specs"""
+        dicMissingOfPath = {}
+        for lPosition in aPositions:
+            dicMissingOfPath.setdefault(aPaths[lPosition // len(aHashSpecs)], []).append(
+                lPosition % len(aHashSpecs))
+        # the images are decoded in background threads while the hashes of the previous ones are calculated
+        dicNewHashes = {}
+        for sPath, aDecodes in iter_images(list(dicMissingOfPath), lNrOfThreads=lNrOfThreads,
+                                           fnLoad=lambda sPath: fnLoad(sPath, dicMissingOfPath[sPath])):
+            for aImage, aIndices in aDecodes:
+                for j, oHash in zip(aIndices, calc_hashes(aImage, [aHashSpecs[j] for j in aIndices])):
+                    dicNewHashes[(sPath, j)] = oHash
+        return [dicNewHashes[(aPaths[lPosition // len(aHashSpecs)], lPosition % len(aHashSpecs))]
+                for lPosition in aPositions]
+
+    aUniquePaths = list(dict.fromkeys(aImagePaths))
+    dicHashesOfPath = {}
+    for lStart in range(0, len(aUniquePaths), BATCH_SIZE):
+        aPaths = aUniquePaths[lStart:lStart + BATCH_SIZE]
+        if oCache is None:
+            aHashes = fnCompute(aPaths, range(len(aPaths) * len(aHashSpecs)))
+        else:
+            # images whose hashes are all cached are not decoded, hashes other threads are
+            # calculating at the moment are waited for
+            aKeys = [oCache.calc_file_key(sPath, *(oSpec + tuple(aKeySuffix)))
+                     for sPath in aPaths for oSpec in aHashSpecs]
+            aHashes = oCache.get_or_compute_many(aKeys, lambda aPositions: fnCompute(aPaths, aPositions))
+        for i, sPath in enumerate(aPaths):
+            dicHashesOfPath[sPath] = aHashes[i * len(aHashSpecs):(i + 1) * len(aHashSpecs)]
+
+    return {oSpec: [dicHashesOfPath[sPath][j] for sPath in aImagePaths]
+            for j, oSpec in enumerate(aHashSpecs)}
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+This module defines a factory for fast test callbacks (wrappers) of perceptual image hashing algorithms.
+A callback created by create_hash_test hashes every distinct image of a challenge only once, loads the
+images in background threads, hashes them in batches through the cache and compares all pairs vectorized.
+"""
+import inspect
+import numpy as np
+from twizzle.twizzle import deduplicate_objects
+from pih_presets.utils import iter_images, REDUCED_DECODE_TAG
+from pih_presets.hashalgos_preset import get_min_image_size
+from pih_presets.deviation_presets import hamming_distances
+from pih_presets.packed_hash import PackedHash, stack_packed_hashes
+
+# number of distinct images whose hashes are looked up in and written to the cache at once
+LOOKUP_BATCH_SIZE = 1000
+# number of decoded images hashed by one call of a batch hash function
+HASH_BATCH_SIZE = 64
+# number of threads loading images ahead of the hashing
+LOADER_THREADS = 4
+
+
+def stack_hashes(aHashes):
+    """ stacks single hashes (packed hashes or arrays) to one stack"""
+    if len(aHashes) > 0 and isinstance(aHashes[0], PackedHash):
+        return stack_packed_hashes(aHashes)
+    return np.stack(aHashes)
+
+
+class HashTest(object):
+    """ HashTest -- test callback of a perceptual image hashing algorithm, see create_hash_test
+    """
+
+    def __init__(self, sAlgorithm, fnHash, fnDeviation=hamming_distances, fnHashBatch=None, fnMinSize=None):
+        """Constructor of a hash test callback
+
+        Note:
+            Use create_hash_test to create an instance. Instances can be pickled (and used by
+            the process backend of the TestRunner) as long as the given functions can.
+        """
+        self.sAlgorithm = sAlgorithm
+        self.fnHash = fnHash
+        self.fnDeviation = fnDeviation
+        self.fnHashBatch = fnHashBatch
+        self.fnMinSize = fnMinSize
+        # names of the parameters of the hash function following the image, in order
+        self.aParameterNames = [sName for sName in list(inspect.signature(fnHash).parameters)[1:]
+                                if sName != "bPacked"]
+
+    def __get_parameters(self, dicHashParameters):
+        """returns all parameters of the hash function in order, defaults filled in"""
+        for sName in dicHashParameters:
+            if sName not in self.aParameterNames:
+                raise Exception("%s has no parameter %s" % (self.sAlgorithm, sName))
+        oSignature = inspect.signature(self.fnHash)
+        return [dicHashParameters.get(sName, oSignature.parameters[sName].default)
+                for sName in self.aParameterNames]
+
+    def __call__(self, aOriginalObjects, aComparativeObjects, lThreshold, oCache=None,
+                 bReducedDecode=False, **dicHashParameters):
+        """ runs the algorithm on a challenge (see Twizzle.run_test)
+
+        Args:
+            aOriginalObjects (:obj:`list` of :obj:`str`): paths of the original images
+            aComparativeObjects (:obj:`list` of :obj:`str`): paths of the comparative images
+            lThreshold (float): pairs whose deviation is smaller than or equal to the threshold are considered
+                                to be the same. It has to be given, None returns the deviations instead of
+                                decisions (for threshold sweeps, see aThresholds of Twizzle.run_test)
+            oCache (:obj:`Cache`): cache to look up and store the hashes (optional)
+            bReducedDecode (bool): decode the images at the reduced resolution the hash needs (see utils.load_image)
+            dicHashParameters: parameters of the hash function, e.g. hash_size=16
+
+        Returns:
+            (aDecisions, dicMetadata): decisions (or deviations) of all pairs and the metadata of the test
+        """
+        # every distinct image is hashed only once, pairs refer to it by index
+        aObjects, aOriginalIndices, aComparativeIndices = deduplicate_objects(aOriginalObjects, aComparativeObjects)
+        return self.run_deduplicated(aObjects, aOriginalIndices, aComparativeIndices,
+                                     lThreshold, oCache, bReducedDecode, **dicHashParameters)
+
+    def run_deduplicated(self, aObjects, aOriginalIndices, aComparativeIndices, lThreshold, oCache=None,
+                         bReducedDecode=False, **dicHashParameters):
+        """ runs the algorithm on a challenge given as table of distinct images and index arrays of the pairs
+
+        Note:
+            Pass it as callback together with bDeduplicateObjects=True to run_test (or run_test_async), then
+            Twizzle builds the table of distinct images. Parameters are the same as of __call__.
+
+        Args:
+            aObjects (:obj:`list` of :obj:`str`): paths of the distinct images
+            aOriginalIndices (:obj:`numpy.ndarray`): index of the original image of every pair in aObjects
+            aComparativeIndices (:obj:`numpy.ndarray`): index of the comparative image of every pair in aObjects
+
+        Returns:
+            (aDecisions, dicMetadata): decisions (or deviations) of all pairs and the metadata of the test
+        """
+        dicMetadata = {"algorithm": self.sAlgorithm}
+        dicMetadata.update(dicHashParameters)
+        if lThreshold is not None:
+            dicMetadata["threshold"] = lThreshold
+        if bReducedDecode:
+            dicMetadata["reduced_decode"] = True
+
+        oHashes = self.get_hashes(list(aObjects), oCache, bReducedDecode, **dicHashParameters)
+
+        # compare all pairs at once
+        aDeviations = np.asarray(self.fnDeviation(
+            oHashes[np.asarray(aComparativeIndices)], oHashes[np.asarray(aOriginalIndices)]))
+        if lThreshold is None:
+            return aDeviations, dicMetadata
+        return aDeviations <= lThreshold, dicMetadata
+
+    def run_streaming(self, oChunks, lThreshold, oCache=None, bReducedDecode=False, **dicHashParameters):
+        """ runs the algorithm on a challenge chunk by chunk (streaming callback, see Twizzle.run_test)
+
+        Note:
+            Pass it as callback together with lChunkSize to run_test (or run_test_async). Images occurring
+            in several chunks are only hashed once if a cache is given. Parameters are the same as of __call__.
+
+        Args:
+            oChunks: iterator of (aOriginalObjects, aComparativeObjects) tuples of paths of one chunk each
+
+        Yields:
+            (aDecisions, dicMetadata): decisions (or deviations) of the pairs of a chunk and the metadata of the test
+        """
+        for aOriginalObjects, aComparativeObjects in oChunks:
+            yield self(aOriginalObjects, aComparativeObjects, lThreshold, oCache, bReducedDecode, **dicHashParameters)
+
+    def get_hashes(self, aImagePaths, oCache=None, bReducedDecode=False, **dicHashParameters):
+        """ loads the images and calculates their hashes, uses the cache if given
+
+        Note:
+            The hashes are cached under calc_file_key(path, algorithm, *parameters) like precompute_hashes
+            of hash_pipeline does, so both can fill the cache for each other. Missing hashes are calculated
+            through Cache.get_or_compute_many, so concurrent tests do not hash the same images twice.
+
+        Returns:
+            stack of the hashes of aImagePaths
+        """
+        aParameters = self.__get_parameters(dicHashParameters)
+        dicLoadParameters = {}
+        aCacheKeyBase = [self.sAlgorithm] + aParameters
+        if bReducedDecode:
+            fnMinSize = self.fnMinSize
+            lMinSize = fnMinSize(*aParameters) if fnMinSize is not None else get_min_image_size(
+                self.sAlgorithm, *aParameters)
+            dicLoadParameters = {"lMinSize": lMinSize, "bGrayscale": True}
+            aCacheKeyBase.append(REDUCED_DECODE_TAG)
+
+        def fnCompute(aPaths):
+            """hashes a list of images, returns the hashes in order"""
+            dicPositionOfPath = {sPath: i for i, sPath in enumerate(dict.fromkeys(aPaths))}
+            aNewHashes = [None] * len(dicPositionOfPath)
+            for aPositions, aBatchHashes in self.__calc_hashes(list(dicPositionOfPath), dicPositionOfPath,
+                                                               dicLoadParameters, dicHashParameters):
+                for i, oHash in zip(aPositions, aBatchHashes):
+                    aNewHashes[i] = oHash
+            return [aNewHashes[dicPositionOfPath[sPath]] for sPath in aPaths]
+
+        aHashes = []
+        for lStart in range(0, len(aImagePaths), LOOKUP_BATCH_SIZE):
+            aPaths = aImagePaths[lStart:lStart + LOOKUP_BATCH_SIZE]
+            if oCache is None:
+                aHashes.extend(fnCompute(aPaths))
+                continue
+            # hashes other tests are calculating at the moment are waited for, not calculated again
+            aKeys = [oCache.calc_file_key(sPath, *aCacheKeyBase) for sPath in aPaths]
+            aHashes.extend(oCache.get_or_compute_many(
+                aKeys, lambda aPositions: fnCompute([aPaths[i] for i in aPositions])))
+        return stack_hashes(aHashes)
+
+    @staticmethod
+    def __split_stack(oStack):
+        """splits a stack of hashes into single hashes"""
+        return [oStack[i] for i in range(len(oStack))]
+
+    def __calc_hashes(self, aPaths, dicPositionOfPath, dicLoadParameters, dicHashParameters):
+        """ hashes images loaded in background threads, in batches if a batch hash function is given
+
+        Yields:
+            (aPositions, aHashes): positions of the images and their hashes
+        """
+        aPositions = []
+        aImages = []
+        for sPath, aImage in iter_images(aPaths, lNrOfThreads=LOADER_THREADS, **dicLoadParameters):
+            if aImage is None:
+                raise Exception("Image %s could not be loaded" % sPath)
+            if self.fnHashBatch is None:
+                yield [dicPositionOfPath[sPath]], [self.fnHash(aImage, bPacked=True, **dicHashParameters)]
+                continue
+            aPositions.append(dicPositionOfPath[sPath])
+            aImages.append(aImage)
+            if len(aImages) >= HASH_BATCH_SIZE:
+                yield aPositions, self.__split_stack(self.fnHashBatch(aImages, **dicHashParameters))
+                aPositions, aImages = [], []
+        if aImages:
+            yield aPositions, self.__split_stack(self.fnHashBatch(aImages, **dicHashParameters))
+
+
+def create_hash_test(sAlgorithm, fnHash, fnDeviation=hamming_distances, fnHashBatch=None, fnMinSize=None):
+    """ creates a fast test callback (wrapper) for a perceptual image hashing algorithm
+
+    Note:
+        The callback is called like fnCallback(aOriginalObjects, aComparativeObjects, lThreshold, oCache=None,
+        bReducedDecode=False, **dicHashParameters) and fulfills the specification of Twizzle.run_test.
+        The threshold is required, pass lThreshold=None together with aThresholds for threshold sweeps.
+        Every distinct image is loaded and hashed only once, all pairs are compared in one call of fnDeviation.
+
+    Args:
+        sAlgorithm (str): name of the algorithm, saved as metadata and used in the cache keys
+        fnHash (function): hash function fnHash(image, ..., bPacked=False) returning the hash of one image
+        fnDeviation (function): function calculating the deviations of two aligned stacks of hashes
+        fnHashBatch (function): optional function returning the stacked hashes of a list of images
+        fnMinSize (function): optional function returning the image size the hash needs from the parameters
+                              of fnHash (default: hashalgos_preset.get_min_image_size)
+
+    Returns:
+        :obj:`HashTest`: the callback
+
+    Example:
+        test_aHash = create_hash_test("aHash", aHash, fnHashBatch=aHash_batch)
+        oRunner.run_test_async("challenge", test_aHash, {"lThreshold": 0.2, "hash_size": 16})
+    """
+    return HashTest(sAlgorithm, fnHash, fnDeviation, fnHashBatch, fnMinSize)
@@ -1,9 +1,60 @@
 """
 This module defines common perceptual image hashing algorithms that can be used as an example
 """
-import numpy
+import numpy as np
 import cv2
-from scipy import fftpack as fft
+from functools import lru_cache
+from pih_presets.packed_hash import pack_hash
+
+def convert_stack_to_grayscale(aImages):
+    """ converts a stack of BGR images of shape (N, h, w, 3) to grayscale in one call of cv2.cvtColor
+
+    Note:
+        The images are converted as one tall image, so the result is the same as converting every
+        image on its own with cv2.cvtColor. Stacks of grayscale images (N, h, w) are returned as they are.
+    """
+    if aImages.ndim == 3:
+        return aImages
+    lNrOfImages, lHeight, lWidth = aImages.shape[:3]
+    if lNrOfImages == 0:
+        return np.zeros((0, lHeight, lWidth), dtype=np.uint8)
+    aGray = cv2.cvtColor(np.ascontiguousarray(aImages).reshape(lNrOfImages * lHeight, lWidth, 3),
+                         cv2.COLOR_BGR2GRAY)
+    return aGray.reshape(lNrOfImages, lHeight, lWidth)
+
+
+def resize_to_stack(aImages, lWidth, lHeight):
+    """ resizes a list (or stack) of images to the same size and stacks them
+
+    Returns:
+        :obj:`numpy.ndarray`: stack of shape (N, lHeight, lWidth) or (N, lHeight, lWidth, 3)
+    """
+    aResized = [cv2.resize(aImage, (lWidth, lHeight), interpolation=cv2.INTER_AREA)
+                for aImage in aImages]
+    if len(aResized) == 0:
+        return np.zeros((0, lHeight, lWidth, 3), dtype=np.uint8)
+    return np.stack(aResized)
+
+
+def get_min_image_size(sAlgorithm, *aParameters):
+    """ returns the minimal width and height an image needs to be hashed without upscaling
+
+    Note:
+        Pass it as lMinSize to utils.load_image to decode images at reduced resolution.
+
+    Args:
+        sAlgorithm (str): name of the hash function (aHash, dHash or pHash)
+        aParameters: positional parameters of the hash function following the image
+    """
+    if sAlgorithm == "aHash":
+        return aParameters[0] if aParameters else 8
+    if sAlgorithm == "dHash":
+        return (aParameters[0] if aParameters else 8) + 1
+    if sAlgorithm == "pHash":
+        dSize = aParameters[0] if len(aParameters) > 0 else 8
+        dFactor = aParameters[1] if len(aParameters) > 1 else 4
+        return dSize * dFactor
+    raise Exception("Unknown hash algorithm %s" % sAlgorithm)
 
 
 """
@@ -11,7 +62,7 @@ Average Hash - AHash
 """
 
 
-def aHash(image, hash_size=8):
+def aHash(image, hash_size=8, bPacked=False):
 
     if hash_size < 0:
         raise ValueError("Hash size must be positive")
@@ -19,55 +70,148 @@ def aHash(image, hash_size=8):
     # reduce size and complexity, then covert to grayscale
     image = cv2.resize(image, (hash_size, hash_size),
                        interpolation=cv2.INTER_AREA)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # find average pixel value
     avg = gray.mean()
     # create string of bits
     diff = gray > avg
     # make a hash
+    if bPacked:
+        return pack_hash(diff.flatten())
     return diff.flatten()
 
 
+def aHash_batch(aImages, hash_size=8):
+    """ calculates the aHash of a list or stack of images at once
+
+    Note:
+        Only resizing is done image by image, grayscale conversion, averaging and comparison
+        are vectorized over the whole stack. The hashes equal those of aHash.
+
+    Returns:
+        :obj:`PackedHash`: stack of N packed hashes of hash_size*hash_size bits
+    """
+    if hash_size < 0:
+        raise ValueError("Hash size must be positive")
+
+    aGray = convert_stack_to_grayscale(
+        resize_to_stack(aImages, hash_size, hash_size))
+    aAvg = aGray.mean(axis=(1, 2))
+    aDiff = aGray > aAvg[:, None, None]
+    return pack_hash(aDiff.reshape(aDiff.shape[0], aDiff.shape[1] * aDiff.shape[2]))
+
+
 #------------------------------------------------------------------------------#
 """
 Difference Hash - DHash
 """
 
 
-def dHash(image, hash_size=8):
+def dHash(image, hash_size=8, bPacked=False):
 
     if hash_size < 0:
         raise ValueError("Hash size must be positive")
 
     image = cv2.resize(image, (hash_size+1, hash_size),
                        interpolation=cv2.INTER_AREA)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # compute differences between columns
     diff = gray[:, 1:] > gray[:, :-1]
+    if bPacked:
+        return pack_hash(diff.flatten())
     return diff.flatten()
 
 
+def dHash_batch(aImages, hash_size=8):
+    """ calculates the dHash of a list or stack of images at once
+
+    Note:
+        Only resizing is done image by image, grayscale conversion and comparison are
+        vectorized over the whole stack. The hashes equal those of dHash.
+
+    Returns:
+        :obj:`PackedHash`: stack of N packed hashes of hash_size*hash_size bits
+    """
+    if hash_size < 0:
+        raise ValueError("Hash size must be positive")
+
+    aGray = convert_stack_to_grayscale(
+        resize_to_stack(aImages, hash_size + 1, hash_size))
+    aDiff = aGray[:, :, 1:] > aGray[:, :, :-1]
+    return pack_hash(aDiff.reshape(aDiff.shape[0], aDiff.shape[1] * aDiff.shape[2]))
+
+
 #------------------------------------------------------------------------------#
 """
 PHash
 """
 
 
-def pHash(image, dSize=8, dFactor=4):
+@lru_cache(maxsize=None)
+def get_dct_basis(lSize):
+    """ returns the orthonormal DCT-II basis matrix of the given size
+
+    Note:
+        The 2-D DCT of a square image X is get_dct_basis(size) @ X @ get_dct_basis(size).T.
+        The matrix is calculated once per size and cached.
+    """
+    aN = np.arange(lSize)
+    aBasis = np.cos(np.pi * (2 * aN[None, :] + 1) * aN[:, None] / (2 * lSize))
+    aBasis *= np.sqrt(2. / lSize)
+    aBasis[0] /= np.sqrt(2.)
+    aBasis.setflags(write=False)
+    return aBasis
+
+
+def _pHash_bits(aGray, dSize):
+    """ calculates the bits of the pHash of a stack of downscaled grayscale images"""
+    # only the dSize lowest frequencies of both axes are needed
+    aBasisLow = get_dct_basis(aGray.shape[-1])[:dSize]
+    p_dct_low = aBasisLow @ aGray.astype(np.float64) @ aBasisLow.T
+
+    # compute average of low frequencies without the DC coefficient dominating it
+    aLow = p_dct_low.reshape(p_dct_low.shape[0], -1)
+    p_avg = aLow[:, 1:].mean(axis=1)
+
+    return aLow > p_avg[:, None]
+
+
+def pHash(image, dSize=8, dFactor=4, bPacked=False):
+    """ calculates the pHash of an image
+
+    Note:
+        The image is reduced to (dSize*dFactor)x(dSize*dFactor) pixels, the bits
+        are the dSize x dSize lowest frequencies of its 2-D DCT compared to their average.
+    """
+    if dSize < 0 or dFactor < 0:
+        raise ValueError("Hash size must be positive")
+
     image = cv2.resize(image, (dSize*dFactor, dSize*dFactor),
                        interpolation=cv2.INTER_AREA)
-    gray = ip.convert_image_to_grayscale(image)
+    gray = convert_stack_to_grayscale(image[None])
+
+    p_dif = _pHash_bits(gray, dSize)[0]
 
-    # DCT berechnen
-    p_dct = fft.dct(gray)
+    if bPacked:
+        return pack_hash(p_dif)
+    return p_dif
 
-    # compute average of low frequencies
-    p_dct_low = np.array(p_dct[: dSize, 1:dSize+1])
-    # p_dct_low[0,0]=0
-    p_avg = p_dct_low.mean()
 
-    p_dif = p_dct_low > p_avg
+def pHash_batch(aImages, dSize=8, dFactor=4):
+    """ calculates the pHash of a list or stack of images at once
+
+    Note:
+        Only resizing is done image by image, the DCT of the whole stack are two matrix
+        multiplications. The hashes equal those of pHash.
+
+    Returns:
+        :obj:`PackedHash`: stack of N packed hashes of dSize*dSize bits
+    """
+    if dSize < 0 or dFactor < 0:
+        raise ValueError("Hash size must be positive")
 
-    return p_dif.flatten()
+    aGray = convert_stack_to_grayscale(
+        resize_to_stack(aImages, dSize*dFactor, dSize*dFactor))
+    return pack_hash(_pHash_bits(aGray, dSize))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+This module defines a bit-packed representation of binary hashes.
+Packed hashes use one bit per hash bit instead of one byte, so they need 8 times less
+memory in caches and on disk and can be compared by counting the bits set in their XOR.
+"""
+import numpy as np
+
+# number of bits set in every possible byte
+POPCOUNT_TABLE = np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount(aWords):
+    """ counts the bits set in every element of an unsigned integer array
+
+    Note:
+        Uses numpy.bitwise_count if available (numpy >= 2.0), a lookup table otherwise.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(aWords)
+    return POPCOUNT_TABLE[aWords.view(np.uint8)].reshape(aWords.shape + (-1,)).sum(axis=-1)
+
+
+def _restore_packed_hash(bWords, tpShape, lBits):
+    """recreate a pickled packed hash"""
+    return PackedHash(np.frombuffer(bWords, dtype=np.uint8).reshape(tpShape), lBits)
+
+
+class PackedHash(object):
+    """ PackedHash -- binary hash (or stack of binary hashes of the same length) packed into bytes
+    """
+    __slots__ = ("words", "bits")
+
+    def __init__(self, aWords, lBits):
+        """Constructor of a packed hash
+
+        Note:
+            Use pack_hash to create a packed hash from an array of bits.
+        Args:
+            aWords (:obj:`numpy.ndarray`): uint8 array of shape (words,) for a single hash or
+                                           (N, words) for a stack of N hashes
+            lBits (int): number of bits of a hash
+        """
+        self.words = np.asarray(aWords, dtype=np.uint8)
+        self.bits = int(lBits)
+
+    def unpack(self):
+        """ returns the bits of the hash as boolean array of shape (bits,) or (N, bits)"""
+        return np.unpackbits(self.words, axis=-1, count=self.bits).astype(bool)
+
+    def as_uint64(self):
+        """ returns the hash as uint64 words of shape (words64,) or (N, words64), padded with zero bits"""
+        lPadding = (-self.words.shape[-1]) % 8
+        aWords = self.words
+        if lPadding:
+            aPadding = [(0, 0)] * (aWords.ndim - 1) + [(0, lPadding)]
+            aWords = np.pad(aWords, aPadding)
+        return np.ascontiguousarray(aWords).view(np.uint64)
+
+    def __reduce__(self):
+        """pickle the raw bytes only, keeps cache entries of packed hashes small"""
+        return (_restore_packed_hash, (self.words.tobytes(), self.words.shape, self.bits))
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+    def is_stack(self):
+        """ returns True if this is a stack of hashes instead of a single one"""
+        return self.words.ndim == 2
+
+    def __len__(self):
+        if not self.is_stack():
+            raise TypeError("a single packed hash has no length, use bits")
+        return self.words.shape[0]
+
+    def __getitem__(self, oIndex):
+        """ returns a single hash (integer index) or a sub stack (slice or index array) of a stack"""
+        if not self.is_stack():
+            raise TypeError("a single packed hash can not be indexed")
+        return PackedHash(self.words[oIndex], self.bits)
+
+    def __eq__(self, oOther):
+        return isinstance(oOther, PackedHash) and self.bits == oOther.bits and np.array_equal(self.words, oOther.words)
+
+    def __ne__(self, oOther):
+        return not self == oOther
+
+    def __hash__(self):
+        return hash((self.bits, self.words.tobytes()))
+
+    def __repr__(self):
+        if self.is_stack():
+            return "PackedHash(%i hashes, %i bits)" % (len(self), self.bits)
+        return "PackedHash(%s, %i bits)" % (self.words.tobytes().hex(), self.bits)
+
+
+def pack_hash(aBits):
+    """ packs a binary hash given as array of bits
+
+    Args:
+        aBits (:obj:`numpy.ndarray`): boolean array of shape (bits,) for a single hash or (N, bits) for a stack
+
+    Returns:
+        :obj:`PackedHash`: the packed hash
+    """
+    aBits = np.asarray(aBits, dtype=bool)
+    return PackedHash(np.packbits(aBits, axis=-1), aBits.shape[-1])
+
+
+def stack_packed_hashes(aHashes):
+    """ stacks single packed hashes of the same length to a stack of hashes"""
+    if len(aHashes) == 0:
+        raise Exception("At least one hash is needed to build a stack")
+    lBits = aHashes[0].bits
+    if any(oHash.bits != lBits for oHash in aHashes):
+        raise Exception("All hashes of a stack have to have the same length")
+    return PackedHash(np.stack([oHash.words for oHash in aHashes]), lBits)
@@ -8,6 +8,8 @@
 import cv2
 import os
 import string
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 
 def escape_home_in_path(sPath):
@@ -19,9 +21,124 @@ def save_image(aImage, sPathToImage):
     cv2.imwrite(escape_home_in_path(sPathToImage), aImage)
 
 
-def load_image(sPathToImage):
-    """load an image from disk"""
-    return cv2.imread(escape_home_in_path(sPathToImage))
+# reduced resolution decoding modes of cv2.imread by their scale factor, largest factor first
+REDUCED_COLOR_MODES = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                       (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2)]
+REDUCED_GRAYSCALE_MODES = [(8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                           (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                           (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)]
+
+# added to cache keys of values calculated from images decoded at reduced resolution
+REDUCED_DECODE_TAG = "reduced_decode"
+
+
+def load_image(sPathToImage, lMinSize=None, bGrayscale=False):
+    """load an image from disk
+
+    Note:
+        If lMinSize is given the image is decoded at the lowest resolution (1/8, 1/4 or 1/2 or
+        full resolution) whose width and height are still at least lMinSize pixels. JPEG images
+        are decoded at reduced resolution directly, which is much faster and needs much less
+        memory than decoding the full image.
+
+    Args:
+        sPathToImage (str): path of the image
+        lMinSize (int): minimal width and height the consumer of the image needs (optional)
+        bGrayscale (bool): decode to a grayscale image instead of a BGR image
+    """
+    return load_image_sizes(sPathToImage, [lMinSize], bGrayscale)[0]
+
+
+def load_image_sizes(sPathToImage, aMinSizes, bGrayscale=False):
+    """load an image from disk for several consumers needing different sizes
+
+    Note:
+        Returns the same images as load_image called with every size of aMinSizes, but every
+        resolution is decoded only once. Sizes that result in the same resolution get the same
+        image object.
+
+    Args:
+        sPathToImage (str): path of the image
+        aMinSizes (:obj:`list` of :obj:`int`): minimal width and height of every consumer (None for full size)
+        bGrayscale (bool): decode to grayscale images instead of BGR images
+
+    Returns:
+        :obj:`list`: the image of every size in the order of aMinSizes
+    """
+    sPath = escape_home_in_path(sPathToImage)
+    # decoded images by reduction factor, 1 is the full resolution
+    dicImageOfFactor = {}
+
+    def decode(lFactor, lMode):
+        if lFactor not in dicImageOfFactor:
+            dicImageOfFactor[lFactor] = cv2.imread(sPath, lMode)
+        return dicImageOfFactor[lFactor]
+
+    aImages = []
+    for lMinSize in aMinSizes:
+        aImages.append(None)
+        bFound = False
+        if lMinSize is not None:
+            lLargestSize = None
+            for lFactor, lMode in (REDUCED_GRAYSCALE_MODES if bGrayscale else REDUCED_COLOR_MODES):
+                # skip factors that give a too small image for sure, a previous decode bounds the full size
+                if lLargestSize is not None and lLargestSize // lFactor < lMinSize:
+                    continue
+                aImage = decode(lFactor, lMode)
+                if aImage is None or min(aImage.shape[:2]) >= lMinSize:
+                    aImages[-1] = aImage
+                    bFound = True
+                    break
+                lLargestSize = min(aImage.shape[:2]) * lFactor
+        if not bFound:
+            aImages[-1] = decode(1, cv2.IMREAD_GRAYSCALE if bGrayscale else cv2.IMREAD_COLOR)
+    return aImages
+
+
+def iter_images(aImagePaths, lNrOfThreads=4, lMaxInFlight=16, fnIsCached=None, fnLoad=None, **dicLoadParameters):
+    """ loads images in background threads ahead of the consumer and yields them in order
+
+    Note:
+        Reading and decoding (cv2 releases the GIL) of the next images overlaps with the work
+        the consumer does on the current one. At most lMaxInFlight decoded images are held in
+        memory at the same time.
+
+    Args:
+        aImagePaths (:obj:`list` of :obj:`str`): paths of the images
+        lNrOfThreads (int): number of threads loading images
+        lMaxInFlight (int): maximal number of images loaded ahead of the consumer
+        fnIsCached (function): optional function getting a path, paths it returns True for are skipped
+        fnLoad (function): optional function getting a path and returning the loaded image
+                           (default: load_image called with dicLoadParameters)
+        dicLoadParameters: parameters passed to load_image, e.g. lMinSize and bGrayscale
+
+    Yields:
+        (sPath, aImage): path and loaded image of every path not skipped, in the order of aImagePaths
+    """
+    if lNrOfThreads < 1 or lMaxInFlight < 1:
+        raise ValueError("Number of threads and images in flight must be positive")
+    if fnLoad is None:
+        def fnLoad(sPath):
+            return load_image(sPath, **dicLoadParameters)
+
+    oPaths = (sPath for sPath in aImagePaths
+              if fnIsCached is None or not fnIsCached(sPath))
+    oPool = ThreadPool(processes=lNrOfThreads)
+    try:
+        queueInFlight = deque()
+        for sPath in oPaths:
+            queueInFlight.append((sPath, oPool.apply_async(fnLoad, (sPath,))))
+            if len(queueInFlight) >= lMaxInFlight:
+                sNextPath, oResult = queueInFlight.popleft()
+                yield sNextPath, oResult.get()
+        while queueInFlight:
+            sNextPath, oResult = queueInFlight.popleft()
+            yield sNextPath, oResult.get()
+    finally:
+        # also reached if the consumer stops early, pending loads are discarded
+        oPool.terminate()
+        oPool.join()
 
 
 def create_path(sPath):
@@ -1,4 +1,5 @@
 
+import numpy as np
 import pandas as pd
 from twizzle import Twizzle
 
@@ -19,14 +20,13 @@ class AnalysisDataGenerator(object):
         if sDBPath is None:
             raise Exception("Path to SQL-Database has to be defined")
         tw = Twizzle(sDBPath)
-        dfChallenges = pd.DataFrame(tw.get_challenges())
+        self.tw = tw
+        dfChallenges = pd.DataFrame(tw.get_challenge_summaries())
         if dfChallenges.empty:
             raise Exception("currently there are no challenges defined yet")
         dfTests = pd.DataFrame(tw.get_tests())
         if dfTests.empty:
             raise Exception("currently no test have been run yet")
-        dfChallenges = dfChallenges.drop(
-            labels=["originalObjects", "comparativeObjects", "targetDecisions"], axis=1)
         dfTests = pd.merge(dfTests, dfChallenges, how="inner",
                            left_on="challenge", right_on="challenge")
         self.dataframe = dfTests
@@ -38,6 +38,25 @@ class AnalysisDataGenerator(object):
         """
         return self.dataframe
 
+    def get_roc_curves(self):
+        """ get the ROC curves saved with the tests of threshold sweeps
+
+        Note:
+            The curves were calculated while running the tests, nothing is recomputed here.
+            Tests of a threshold sweep share the same curve. Join the result with the dataframe of
+            get_pandas_dataframe on the column `test_id` to get parameters and challenge information.
+        Returns:
+            Pandas Dataframe with the columns `test_id`, `threshold`, `FPR` and `TPR` having one row per point of a curve
+        """
+        aFrames = []
+        for lTestId, dicROC in self.tw.get_test_artifacts("roc").items():
+            aFrames.append(pd.DataFrame({"test_id": np.full(len(dicROC["thresholds"]), lTestId),
+                                         "threshold": dicROC["thresholds"],
+                                         "FPR": dicROC["FPR"], "TPR": dicROC["TPR"]}))
+        if not aFrames:
+            return pd.DataFrame(columns=["test_id", "threshold", "FPR", "TPR"])
+        return pd.concat(aFrames, ignore_index=True)
+
     def save_pandas_dataframe_to_file(self, sPathToFile):
         """ save concatenated analysis data as pandas dataframe to CSV file
         """
@@ -1,59 +1,520 @@
-from threading import Lock
-from sqlitedict import SqliteDict
+import os
+import sys
+import uuid
+import hashlib
+import logging
+import sqlite3
+import weakref
+import numpy as np
+from collections import OrderedDict
+from threading import Lock, Event
+from multiprocessing.util import Finalize
+from twizzle.storage import _encode, _decode
 
+# maximum number of keys looked up in the database by one query
+DB_LOOKUP_BATCH_SIZE = 500
+
+# debug output of the cache, enable it by configuring the logger "twizzle.cache"
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# key and table under which older versions kept the whole cache as a single entry
 CACHE_KEY = "TWIZZLE_CACHE"
+LEGACY_TABLENAME = "unnamed"
+
+# cache handles of the current process by id of the cache they were created from
+_dicProcessCaches = {}
+_lockProcessCaches = Lock()
+
+
+def _estimate_size(oValue):
+    """rough number of bytes an entry occupies in memory"""
+    if isinstance(oValue, np.ndarray):
+        return oValue.nbytes + 112
+    if hasattr(oValue, "nbytes"):
+        # e.g. objects wrapping numpy arrays
+        return int(oValue.nbytes) + sys.getsizeof(oValue)
+    if isinstance(oValue, (list, tuple)):
+        return sys.getsizeof(oValue) + sum(_estimate_size(o) for o in oValue)
+    return sys.getsizeof(oValue)
+
+
+def _encode_key_part(oParam):
+    """encode a parameter of a cache key unambiguously (type tag and length prefix)"""
+    if isinstance(oParam, (bool, np.bool_)):
+        return "b:%i" % bool(oParam)
+    if isinstance(oParam, (int, np.integer)):
+        return "i:%i" % int(oParam)
+    if isinstance(oParam, (float, np.floating)):
+        return "f:%r" % float(oParam)
+    if oParam is None:
+        return "n:"
+    if isinstance(oParam, (list, tuple)):
+        return "l%i[%s]" % (len(oParam), ",".join(_encode_key_part(o) for o in oParam))
+    sValue = str(oParam)
+    sTag = "s" if isinstance(oParam, str) else type(oParam).__name__
+    return "%s%i:%s" % (sTag, len(sValue), sValue)
+
+
+class _Flight(object):
+    """computation of a cache entry that is currently running"""
+
+    def __init__(self):
+        self.event = Event()
+        self.value = None
+        self.error = None
+
+
+def _restore_cache(sCacheId, bPersistent, sPathToPersistenceDB, lCommitInterval, lMaxEntries, lMaxBytes):
+    """get the handle of a cache in the current process, create it on first use
+
+    Note:
+        Used when a Cache is unpickled, e.g. in a worker process of the TestRunner. All
+        tasks of one worker process share one handle per cache.
+    """
+    with _lockProcessCaches:
+        tpKey = (os.getpid(), sCacheId)
+        oCache = _dicProcessCaches.get(tpKey)
+        if oCache is None:
+            oCache = Cache(bPersistent, sPathToPersistenceDB,
+                           lCommitInterval, lMaxEntries, lMaxBytes)
+            oCache._id = sCacheId
+            _dicProcessCaches[tpKey] = oCache
+        return oCache
+
+
+def _flush_cache(oCacheRef):
+    """write pending entries of a cache at exit if it is still alive, without keeping it alive"""
+    oCache = oCacheRef()
+    if oCache is not None:
+        oCache.flush()
+
+
+def flush_process_caches():
+    """write pending entries of all cache handles restored in the current process to disk"""
+    with _lockProcessCaches:
+        aCaches = [oCache for (lPid, _), oCache in _dicProcessCaches.items()
+                   if lPid == os.getpid()]
+    for oCache in aCaches:
+        oCache.flush()
 
 
 class Cache(object):
     """ Cache -- Key-Value Store for Twizzle to reduce unnecessary recomputations
     """
 
-    def __init__(self, bPersistent=False, sPathToPersistenceDB="twizzle_cache.db"):
+    def __init__(self, bPersistent=False, sPathToPersistenceDB="twizzle_cache.db", lCommitInterval=1000,
+                 lMaxEntries=None, lMaxBytes=None):
         """Constructor of the Twizzle Cache
 
         Note:
             You can decide whether the Chache should be persistent between multiple executions or
             just a runtime cache for one execution of a set of tests
+
+            In persistent mode every entry is stored under its own key. New entries are collected
+            and written to disk in one transaction every lCommitInterval entries, on flush() and
+            when the process exits.
+
+            The entries held in memory can be limited by number and by their approximate size. If a
+            limit is exceeded the least recently used entries are evicted from memory. Entries of a
+            persistent cache stay available from disk after their eviction.
         Args:
-            bPersistent (bool): Flag whether the chache should be persistent or not (Note: persistent cache
-            is much slower because it has to write the data to the harddisk)
+            bPersistent (bool): Flag whether the chache should be persistent or not
 
             sPathToPersistenceDB (str): Path to the Cache DB where the Cache should write its data to
+
+            lCommitInterval (int): number of new entries collected before they are written to disk
+
+            lMaxEntries (int): maximum number of entries held in memory (None for no limit)
+
+            lMaxBytes (int): maximum approximate size in bytes of all entries held in memory (None for no limit)
         """
-        self._cache = {}
+        self._cache = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._max_entries = lMaxEntries
+        self._max_bytes = lMaxBytes
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._sets = 0
+        self._writes = 0
+        self._pending = {}
+        self._inflight = {}
         self._lock = Lock()
         self._persistent = bPersistent
-        self._first_get = True
+        self._path = sPathToPersistenceDB
+        self._commit_interval = max(1, lCommitInterval)
+        self._id = uuid.uuid4().hex
+        self._db = None
+        self._finalizer = None
+        # memoized content digests of files by path, together with the file status they belong to
+        self._content_fingerprints = {}
 
         if bPersistent:
             if not sPathToPersistenceDB:
                 raise Exception(
                     "On persistent mode a path to the persistence database has to be defined")
-            self._db = SqliteDict(sPathToPersistenceDB)
+            self._db = sqlite3.connect(
+                sPathToPersistenceDB, check_same_thread=False, timeout=60)
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            self.__migrate_legacy_layout()
+            # write pending entries when the process (also a worker process) exits, the finalizer
+            # only holds a weak reference, so unused caches and their connection can be freed
+            self._finalizer = Finalize(self, _flush_cache, args=(weakref.ref(self),), exitpriority=10)
+
+    def __migrate_legacy_layout(self):
+        """ splits the single cache entry of older versions into one row per key"""
+        if not self._db.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (LEGACY_TABLENAME,)).fetchone():
+            return
+        tpRow = self._db.execute(
+            'SELECT value FROM "%s" WHERE key = ?' % LEGACY_TABLENAME, (CACHE_KEY,)).fetchone()
+        if tpRow is None:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                ((sKey, _encode(oValue)) for sKey, oValue in _decode(tpRow[0]).items()))
+            self._db.execute(
+                'DELETE FROM "%s" WHERE key = ?' % LEGACY_TABLENAME, (CACHE_KEY,))
+
+    def __reduce__(self):
+        """pickle a cache as reference, the receiving process opens its own handle
+
+        Note:
+            The content of a runtime (non persistent) cache is not transferred, every process
+            starts with an empty runtime cache.
+        """
+        return (_restore_cache, (self._id, self._persistent, self._path, self._commit_interval,
+                                 self._max_entries, self._max_bytes))
 
     def set(self, sKey, oValue):
         """set cache element by key"""
-        # debug
-        print("ADDING CACHELINE: %s" % (sKey))
-        self._lock.acquire()
-        self._cache[sKey] = oValue
-        if self._persistent:
-            self._db[CACHE_KEY] = self._cache
-            self._db.commit()
-        self._lock.release()
+        self.set_many({sKey: oValue})
+
+    def set_many(self, dicEntries):
+        """set many cache elements at once
+
+        Args:
+            dicEntries (:obj:): dictionary mapping keys to elements
+        """
+        with self._lock:
+            for sKey, oValue in dicEntries.items():
+                self.__remember(sKey, oValue)
+            self._sets += len(dicEntries)
+            if self._persistent:
+                self._pending.update(dicEntries)
+                if len(self._pending) >= self._commit_interval:
+                    self.__write_pending()
+        if logger.isEnabledFor(logging.DEBUG):
+            for sKey in dicEntries:
+                logger.debug("adding cache line: %s", sKey)
 
     def get(self, sKey):
         """get cache element by key"""
+        return self.get_many([sKey])[0]
+
+    def get_many(self, aKeys):
+        """get many cache elements at once
+
+        Note:
+            Keys missing in memory are looked up on disk in a few queries.
+
+        Args:
+            aKeys (:obj:`list` of :obj:`str`): keys of the elements
+
+        Returns:
+            :obj:`list`: the elements in the order of the keys, None for missing ones
+        """
+        aValues = [None] * len(aKeys)
+        with self._lock:
+            aMissing = []
+            for i, sKey in enumerate(aKeys):
+                oValue = self._cache.get(sKey, None)
+                if oValue is not None:
+                    self._cache.move_to_end(sKey)
+                elif self._persistent:
+                    # evicted entries might not be written to disk yet
+                    oValue = self._pending.get(sKey, None)
+                    if oValue is None:
+                        aMissing.append(i)
+                    else:
+                        self.__remember(sKey, oValue)
+                aValues[i] = oValue
+
+            if aMissing:
+                dicFound = {}
+                aMissingKeys = list({aKeys[i] for i in aMissing})
+                for lStart in range(0, len(aMissingKeys), DB_LOOKUP_BATCH_SIZE):
+                    aBatch = aMissingKeys[lStart:lStart + DB_LOOKUP_BATCH_SIZE]
+                    dicFound.update(self._db.execute(
+                        "SELECT key, value FROM cache WHERE key IN (%s)" % ",".join("?" * len(aBatch)),
+                        aBatch).fetchall())
+                for sKey, bValue in dicFound.items():
+                    dicFound[sKey] = _decode(bValue)
+                    self.__remember(sKey, dicFound[sKey])
+                for i in aMissing:
+                    aValues[i] = dicFound.get(aKeys[i], None)
+
+            lHits = sum(1 for oValue in aValues if oValue is not None)
+            self._hits += lHits
+            self._misses += len(aValues) - lHits
+        return aValues
+
+    def get_or_compute(self, sKey, fnCompute):
+        """get cache element by key, compute and set it if it is missing
+
+        Note:
+            If several threads request the same missing key at the same time, only the first one
+            calls fnCompute. The others wait for its result instead of computing it again. If
+            fnCompute raises an exception, it is raised in all waiting threads.
+
+        Args:
+            sKey (str): key of the cache element
+            fnCompute (function): function without arguments that computes the element
+
+        Returns:
+            the cached or computed element
+        """
+        oValue = self.get(sKey)
+        if oValue is not None:
+            return oValue
+
+        with self._lock:
+            # the element might have been set since the lookup above
+            oValue = self._cache.get(sKey, None)
+            if oValue is None:
+                oValue = self._pending.get(sKey, None)
+            if oValue is not None:
+                return oValue
+            oFlight = self._inflight.get(sKey)
+            bCompute = oFlight is None
+            if bCompute:
+                oFlight = _Flight()
+                self._inflight[sKey] = oFlight
+
+        if not bCompute:
+            oFlight.event.wait()
+            if oFlight.error is not None:
+                raise oFlight.error
+            return oFlight.value
+
+        try:
+            oFlight.value = fnCompute()
+            if oFlight.value is not None:
+                self.set(sKey, oFlight.value)
+            return oFlight.value
+        except Exception as e:
+            oFlight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[sKey]
+            oFlight.event.set()
+
+    def get_or_compute_many(self, aKeys, fnCompute):
+        """get many cache elements at once, compute and set the missing ones in one call
+
+        Note:
+            Like get_or_compute for many keys. Missing keys that are computed by another thread
+            at the moment are not computed again, their results are waited for after computing
+            the remaining ones. If a computation raises an exception, it is raised in all
+            threads waiting for one of its elements.
+
+        Args:
+            aKeys (:obj:`list` of :obj:`str`): keys of the elements
+            fnCompute (function): function computing the elements of a list of positions in aKeys,
+                                  returns the elements in the order of the positions
+
+        Returns:
+            :obj:`list`: the cached or computed elements in the order of the keys
+        """
+        aValues = self.get_many(aKeys)
+        if all(oValue is not None for oValue in aValues):
+            return aValues
+
+        dicOwnFlights = {}
+        dicOtherFlights = {}
+        aPositions = []
+        with self._lock:
+            for i, sKey in enumerate(aKeys):
+                if aValues[i] is not None or sKey in dicOwnFlights or sKey in dicOtherFlights:
+                    continue
+                # the element might have been set since the lookup above
+                oValue = self._cache.get(sKey, None)
+                if oValue is None:
+                    oValue = self._pending.get(sKey, None)
+                if oValue is not None:
+                    aValues[i] = oValue
+                elif sKey in self._inflight:
+                    dicOtherFlights[sKey] = self._inflight[sKey]
+                else:
+                    dicOwnFlights[sKey] = self._inflight[sKey] = _Flight()
+                    aPositions.append(i)
+
+        if dicOwnFlights:
+            try:
+                aComputed = list(fnCompute(aPositions))
+                dicComputed = {aKeys[i]: oValue for i, oValue in zip(aPositions, aComputed)}
+                for sKey, oFlight in dicOwnFlights.items():
+                    oFlight.value = dicComputed.get(sKey)
+                self.set_many({sKey: oValue for sKey, oValue in dicComputed.items() if oValue is not None})
+            except Exception as e:
+                for oFlight in dicOwnFlights.values():
+                    oFlight.error = e
+                raise
+            finally:
+                with self._lock:
+                    for sKey in dicOwnFlights:
+                        del self._inflight[sKey]
+                for oFlight in dicOwnFlights.values():
+                    oFlight.event.set()
+
+        for oFlight in dicOtherFlights.values():
+            oFlight.event.wait()
+            if oFlight.error is not None:
+                raise oFlight.error
+        dicFlights = dict(dicOtherFlights)
+        dicFlights.update(dicOwnFlights)
+        for i, sKey in enumerate(aKeys):
+            if aValues[i] is None and sKey in dicFlights:
+                aValues[i] = dicFlights[sKey].value
+        return aValues
+
+    def __remember(self, sKey, oValue):
+        """put an entry into memory and evict least recently used ones, the lock has to be held"""
+        if sKey in self._cache:
+            self._bytes -= self._sizes[sKey]
+        lSize = _estimate_size(oValue) if self._max_bytes is not None else 0
+        self._cache[sKey] = oValue
+        self._cache.move_to_end(sKey)
+        self._sizes[sKey] = lSize
+        self._bytes += lSize
+        while len(self._cache) > 1 and (
+                (self._max_entries is not None and len(self._cache) > self._max_entries) or
+                (self._max_bytes is not None and self._bytes > self._max_bytes)):
+            sEvictedKey, _ = self._cache.popitem(last=False)
+            self._bytes -= self._sizes.pop(sEvictedKey)
+            self._evictions += 1
+
+    def get_statistics(self):
+        """get counters of the cache
+
+        Returns:
+            :obj:: dictionary holding the number of `hits`, `misses`, `evictions`, `sets` and entries
+                   written to disk (`writes`) as well as the number of `entries` held in memory and
+                   their approximate size in `bytes` (only tracked if lMaxBytes is set)
+        """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "evictions": self._evictions,
+                    "sets": self._sets, "writes": self._writes,
+                    "entries": len(self._cache), "bytes": self._bytes}
+
+    def __write_pending(self):
+        """write all pending entries in one transaction, the lock has to be held"""
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                ((sKey, _encode(oValue)) for sKey, oValue in self._pending.items()))
+        self._writes += len(self._pending)
+        logger.debug("wrote %i cache lines to disk", len(self._pending))
+        self._pending = {}
+
+    def flush(self):
+        """write all pending entries of a persistent cache to disk"""
+        if not self._persistent:
+            return
+        with self._lock:
+            if self._db is not None:
+                self.__write_pending()
 
-        if self._persistent:
-            self._lock.acquire()
-            if self._first_get:
-                self._first_get = False
-                self._cache = self._db.get(CACHE_KEY, {})
-            self._lock.release()
-        return self._cache.get(sKey, None)
+    def close(self):
+        """write all pending entries of a persistent cache to disk and close its database
+
+        Note:
+            The cache can not be used anymore afterwards. Caches that are not referenced
+            anymore are closed automatically.
+        """
+        if self._finalizer is not None:
+            self._finalizer.cancel()
+            self._finalizer = None
+        with self._lock:
+            if self._db is not None:
+                self.__write_pending()
+                self._db.close()
+                self._db = None
+
+    def __del__(self):
+        """write pending entries of an unreferenced cache before it is freed"""
+        try:
+            self.close()
+        except Exception:
+            # the interpreter might be shutting down
+            pass
 
     def calc_unique_key(self, *params):
-        """create a unique key based on parameters given by converting them
-        to string and concatenating them"""
-        return "".join([str(elem) for elem in params])
+        """create a unique key based on parameters given
+
+        Note:
+            Every parameter is encoded with its type and length, so different parameters can not
+            result in the same key (e.g. "aHash1" + "6x" and "aHash" + "16x").
+        """
+        return "|".join([_encode_key_part(elem) for elem in params])
+
+    def calc_file_fingerprint(self, sPath, bContent=False):
+        """get a fingerprint of a file that changes when the file is changed
+
+        Note:
+            By default the fingerprint consists of size, modification time and inode of the file,
+            read on every call. With bContent a SHA-1 digest of the content is used instead. It is
+            independent of the location of the file, so cached values stay valid if a dataset is
+            moved or copied. The digest is memoized and only calculated again if size, modification
+            time or inode of the file change.
+
+        Args:
+            sPath (str): path to the file
+            bContent (bool): use the digest of the content instead of the file status
+
+        Returns:
+            str: the fingerprint
+        """
+        oStat = os.stat(os.path.expanduser(sPath))
+        tpStat = (oStat.st_size, oStat.st_mtime_ns, oStat.st_ino)
+        if not bContent:
+            return "%i-%i-%i" % tpStat
+
+        tpDigest = self._content_fingerprints.get(sPath)
+        if tpDigest is None or tpDigest[0] != tpStat:
+            oDigest = hashlib.sha1()
+            with open(os.path.expanduser(sPath), "rb") as f:
+                for bChunk in iter(lambda: f.read(1 << 20), b""):
+                    oDigest.update(bChunk)
+            tpDigest = (tpStat, oDigest.hexdigest())
+            self._content_fingerprints[sPath] = tpDigest
+        return tpDigest[1]
+
+    def calc_file_key(self, sPath, *params, bContent=False):
+        """create a unique key for a value derived from a file, e.g. the hash of an image
+
+        Note:
+            Instead of the path the fingerprint of the file is used (see calc_file_fingerprint),
+            so cached values are not served anymore after a file was overwritten.
+
+        Args:
+            sPath (str): path to the file
+            *params: further parameters the value depends on (e.g. name of the algorithm and its settings)
+            bContent (bool): use the digest of the content of the file instead of its status
+
+        Returns:
+            str: the key
+        """
+        return self.calc_unique_key(*params, self.calc_file_fingerprint(sPath, bContent))
+
+    def clear_fingerprints(self):
+        """forget all memoized content digests of files"""
+        self._content_fingerprints = {}
@@ -0,0 +1,110 @@
+""" This module calculates deterministic fingerprints of test runs
+
+A fingerprint identifies a run by its challenge, its callback and all parameters. It stays the same
+across restarts of Python, so finished runs can be recognised and skipped and interrupted streaming
+tests can be resumed (see TestRunner).
+"""
+import hashlib
+import inspect
+import functools
+import numpy as np
+from twizzle.cache import Cache
+
+
+def _encode_fingerprint_part(oValue, tpVisiting=()):
+    """encode a value deterministically and unambiguously (type tag and length prefix)
+
+    Note:
+        tpVisiting holds the ids of the functions and objects currently being encoded, references
+        back to them (e.g. a recursive function in its own closure) are encoded by name only.
+    """
+    if isinstance(oValue, Cache):
+        # caches do not change the results of a test
+        return "cache"
+    if oValue is None:
+        return "n:"
+    if isinstance(oValue, (bool, np.bool_)):
+        return "b:%i" % bool(oValue)
+    if isinstance(oValue, (int, np.integer)):
+        return "i:%i" % int(oValue)
+    if isinstance(oValue, (float, np.floating)):
+        return "f:%r" % float(oValue)
+    if isinstance(oValue, str):
+        return "s%i:%s" % (len(oValue), oValue)
+    if isinstance(oValue, bytes):
+        return "y:%s" % hashlib.sha1(oValue).hexdigest()
+    if isinstance(oValue, np.ndarray):
+        return "a:%s:%s:%s" % (oValue.dtype.str, oValue.shape,
+                               hashlib.sha1(np.ascontiguousarray(oValue).tobytes()).hexdigest())
+    if isinstance(oValue, (list, tuple)):
+        return "l%i[%s]" % (len(oValue), ",".join(_encode_fingerprint_part(o, tpVisiting) for o in oValue))
+    if isinstance(oValue, (set, frozenset)):
+        # the order of the elements depends on the hash seed of the interpreter
+        aElements = sorted(_encode_fingerprint_part(o, tpVisiting) for o in oValue)
+        return "e%i{%s}" % (len(aElements), ",".join(aElements))
+    if isinstance(oValue, np.dtype):
+        return "t:%s" % oValue.str
+    if isinstance(oValue, dict):
+        aItems = sorted((_encode_fingerprint_part(k, tpVisiting), _encode_fingerprint_part(v, tpVisiting))
+                        for k, v in oValue.items())
+        return "d%i{%s}" % (len(aItems), ",".join("%s=%s" % tpItem for tpItem in aItems))
+    if isinstance(oValue, functools.partial):
+        return "p(%s,%s,%s)" % (_encode_fingerprint_part(oValue.func, tpVisiting),
+                                _encode_fingerprint_part(oValue.args, tpVisiting),
+                                _encode_fingerprint_part(oValue.keywords, tpVisiting))
+    if inspect.ismethod(oValue):
+        # bound method, identified by its object and its name
+        return "m(%s,%s)" % (_encode_fingerprint_part(oValue.__self__, tpVisiting), oValue.__func__.__qualname__)
+    if inspect.isfunction(oValue):
+        sName = "%s.%s" % (oValue.__module__, oValue.__qualname__)
+        if "<lambda>" in oValue.__qualname__:
+            # lambdas of a module share their name, they differ only by their code
+            raise Exception("The lambda function %s can not be identified reliably, define it with def" % sName)
+        if id(oValue) in tpVisiting:
+            return "c:%s" % sName
+        tpVisiting = tpVisiting + (id(oValue),)
+        # functions created by the same factory differ by the values they captured and their defaults
+        dicClosure = {}
+        for sVariable, oCell in zip(oValue.__code__.co_freevars, oValue.__closure__ or ()):
+            try:
+                dicClosure[sVariable] = oCell.cell_contents
+            except ValueError:
+                # variable not assigned yet
+                dicClosure[sVariable] = "<empty>"
+        return "c:%s(%s,%s,%s)" % (sName, _encode_fingerprint_part(oValue.__defaults__, tpVisiting),
+                                   _encode_fingerprint_part(oValue.__kwdefaults__, tpVisiting),
+                                   _encode_fingerprint_part(dicClosure, tpVisiting))
+    if inspect.isbuiltin(oValue) or inspect.isclass(oValue):
+        return "c:%s.%s" % (oValue.__module__, oValue.__qualname__)
+    sClass = "%s.%s" % (type(oValue).__module__, type(oValue).__qualname__)
+    if hasattr(oValue, "__dict__"):
+        if id(oValue) in tpVisiting:
+            return "o:%s" % sClass
+        return "o:%s%s" % (sClass, _encode_fingerprint_part(vars(oValue), tpVisiting + (id(oValue),)))
+    # e.g. the representation of objects without attribute dictionary holds their memory address
+    raise Exception("Values of type %s can not be identified reliably" % sClass)
+
+
+def calc_test_fingerprint(sChallengeName, fnCallback, dicCallbackParameters, dicRunOptions=None):
+    """ calculates the fingerprint of a test run
+
+    Note:
+        Functions are identified by module and name, the values captured by their closure and their
+        default arguments, not by their code. Changing the code of a callback does not change the
+        fingerprint, rename it or change a parameter to run it again. Lambda functions and values of
+        other types than numbers, strings, containers, numpy arrays, functions and objects with an
+        attribute dictionary can not be identified reliably, an exception is raised for them. Caches
+        passed as parameter are ignored, they do not change the results.
+
+    Args:
+        sChallengeName (str): name of the challenge
+        fnCallback (function): the callback (wrapper) of the test
+        dicCallbackParameters (:obj:): parameters of the callback
+        dicRunOptions (:obj:): further arguments of Twizzle.run_test (e.g. thresholds)
+
+    Returns:
+        str: hex digest identifying the run
+    """
+    sEncoded = _encode_fingerprint_part(
+        [sChallengeName, fnCallback, dicCallbackParameters, dicRunOptions or {}])
+    return hashlib.sha1(sEncoded.encode("utf-8")).hexdigest()
@@ -0,0 +1,153 @@
+""" This module defines the metrics Twizzle calculates from the decisions of a test
+"""
+import numpy as np
+
+
+def calc_confusion_counts(aDecisions, aTargetDecisions):
+    """ counts true positives, true negatives, false positives and false negatives
+
+    Args:
+        aDecisions (:obj:`list` of :obj:`bool`): decisions of the algorithm under test
+        aTargetDecisions (:obj:`list` of :obj:`bool`): correct decisions of the challenge
+
+    Returns:
+        (lTP, lTN, lFP, lFN): the four counts
+    """
+    aDecisions = np.asarray(aDecisions, dtype=bool)
+    aTargetDecisions = np.asarray(aTargetDecisions, dtype=bool)
+    lTP = int(np.count_nonzero(aDecisions & aTargetDecisions))
+    lFP = int(np.count_nonzero(aDecisions & ~aTargetDecisions))
+    lPositives = int(np.count_nonzero(aTargetDecisions))
+    lFN = lPositives - lTP
+    lTN = (aTargetDecisions.size - lPositives) - lFP
+    return lTP, lTN, lFP, lFN
+
+
+def pack_decisions(aDecisions):
+    """ packs boolean decisions into bits to be stored compactly (1 bit per object pair)
+
+    Returns:
+        :obj:: dictionary holding the packed bits under `packed` and the number of decisions under `size`
+    """
+    aDecisions = np.asarray(aDecisions, dtype=bool)
+    return {"packed": np.packbits(aDecisions), "size": aDecisions.size}
+
+
+def unpack_decisions(dicPackedDecisions):
+    """ restores the boolean decisions packed by pack_decisions"""
+    return np.unpackbits(dicPackedDecisions["packed"], count=dicPackedDecisions["size"]).astype(bool)
+
+
+def calc_threshold_confusion_counts(aDeviations, aTargetDecisions, aThresholds):
+    """ counts true positives, true negatives, false positives and false negatives for many thresholds
+
+    Note:
+        A pair is considered to be the same if its deviation is smaller than or equal to the threshold.
+        Instead of comparing every deviation to every threshold the deviations of both classes are sorted
+        once and the counts of all thresholds are looked up by binary search.
+
+    Args:
+        aDeviations (:obj:`list` of :obj:`float`): deviation of every object pair
+        aTargetDecisions (:obj:`list` of :obj:`bool`): correct decisions of the challenge
+        aThresholds (:obj:`list` of :obj:`float`): thresholds to evaluate
+
+    Returns:
+        (aTP, aTN, aFP, aFN): arrays holding the four counts for every threshold
+    """
+    aDeviations = np.asarray(aDeviations, dtype=np.float64)
+    aTargetDecisions = np.asarray(aTargetDecisions, dtype=bool)
+    aThresholds = np.asarray(aThresholds, dtype=np.float64)
+    aPositiveDeviations = np.sort(aDeviations[aTargetDecisions])
+    aNegativeDeviations = np.sort(aDeviations[~aTargetDecisions])
+
+    aTP = np.searchsorted(aPositiveDeviations, aThresholds, side="right")
+    aFP = np.searchsorted(aNegativeDeviations, aThresholds, side="right")
+    aFN = aPositiveDeviations.size - aTP
+    aTN = aNegativeDeviations.size - aFP
+    return aTP, aTN, aFP, aFN
+
+
+def calc_metrics(lTP, lTN, lFP, lFN):
+    """ calculates rates and scores from the confusion counts
+
+    Returns:
+        :obj:: dictionary holding TPR, TNR, FPR, FNR, Accuracy, Precision and F1_score
+    """
+    #True positive Rate / Recall -- Robustness in PIH
+    dTPR = lTP / (lTP + lFN) if ((lTP+lFN)>0) else 0.
+    # True negative Rate -- Sensitivity
+    dTNR = lTN / (lTN + lFP) if ((lTN+lFP)>0) else 0.
+    # False positive Rate / FAR
+    dFPR = 1 - dTNR
+    # False negative Rate / FRR
+    dFNR = 1 - dTPR
+
+    dAccuracy = (lTP+lTN)/(lTP+lTN+lFP+lFN)
+    dPrecision = lTP/(lTP+lFP) if ((lTP+lFP) > 0.) else 0.
+    dF1score = 2*((dPrecision*dTPR)/(dPrecision+dTPR)) if ((dPrecision+dTPR)>0) else 0.
+
+    return {"TPR": dTPR,  # Recall
+            "TNR": dTNR,
+            "FPR": dFPR,  # FAR
+            "FNR": dFNR,  # FRR
+            "Accuracy": dAccuracy,
+            "Precision": dPrecision,
+            "F1_score": dF1score}
+
+
+def calc_roc(aDeviations, aTargetDecisions):
+    """ calculates the ROC curve, its AUC, the equal error rate and the optimal threshold
+
+    Note:
+        A pair is considered to be the same if its deviation is smaller than or equal to the threshold.
+        The deviations are sorted once, every distinct deviation is a threshold of the curve.
+        The curve starts at the point (0, 0) belonging to the threshold -inf.
+        The equal error rate is the (linearly interpolated) rate where FPR equals FNR. The optimal
+        threshold maximizes Youden's J statistic TPR - FPR.
+
+    Args:
+        aDeviations (:obj:`list` of :obj:`float`): deviation of every object pair
+        aTargetDecisions (:obj:`list` of :obj:`bool`): correct decisions of the challenge
+
+    Returns:
+        :obj:: dictionary holding the arrays `thresholds`, `FPR` and `TPR` of the curve and the
+               values `AUC`, `EER`, `EER_threshold` and `optimal_threshold`
+    """
+    aDeviations = np.asarray(aDeviations, dtype=np.float64)
+    aTargetDecisions = np.asarray(aTargetDecisions, dtype=bool)
+    lPositives = int(np.count_nonzero(aTargetDecisions))
+    lNegatives = aTargetDecisions.size - lPositives
+
+    aOrder = np.argsort(aDeviations, kind="stable")
+    aSortedDeviations = aDeviations[aOrder]
+    aSortedTargets = aTargetDecisions[aOrder]
+
+    # last position of every distinct deviation
+    aLast = np.flatnonzero(
+        np.r_[aSortedDeviations[1:] != aSortedDeviations[:-1], True]) if aSortedDeviations.size else np.array([], dtype=int)
+    aCumTP = np.cumsum(aSortedTargets)[aLast]
+    aCumFP = (aLast + 1) - aCumTP
+
+    aThresholds = np.r_[-np.inf, aSortedDeviations[aLast]]
+    aTPR = np.r_[0., aCumTP / lPositives] if lPositives > 0 else np.full(aThresholds.size, np.nan)
+    aFPR = np.r_[0., aCumFP / lNegatives] if lNegatives > 0 else np.full(aThresholds.size, np.nan)
+
+    dicROC = {"thresholds": aThresholds, "FPR": aFPR, "TPR": aTPR,
+              "AUC": np.nan, "EER": np.nan, "EER_threshold": np.nan, "optimal_threshold": np.nan}
+    if lPositives == 0 or lNegatives == 0:
+        return dicROC
+
+    dicROC["AUC"] = float(np.sum(np.diff(aFPR) * (aTPR[1:] + aTPR[:-1]) / 2))
+
+    # FPR grows and FNR falls with the threshold, find where they cross
+    aDifference = aFPR - (1 - aTPR)
+    k = int(np.argmax(aDifference >= 0))
+    if k == 0:
+        dEER = aFPR[0]
+    else:
+        dT = aDifference[k-1] / (aDifference[k-1] - aDifference[k])
+        dEER = aFPR[k-1] + dT * (aFPR[k] - aFPR[k-1])
+    dicROC["EER"] = float(dEER)
+    dicROC["EER_threshold"] = float(aThresholds[k])
+    dicROC["optimal_threshold"] = float(aThresholds[int(np.argmax(aTPR - aFPR))])
+    return dicROC
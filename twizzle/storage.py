@@ -0,0 +1,457 @@
+import hashlib
+import pickle
+import sqlite3
+import numpy as np
+from threading import RLock
+from sqlitedict import SqliteDict
+
+# keys and table used by databases written with the old sqlitedict layout
+LEGACY_TABLENAME = "unnamed"
+LEGACY_CHALLENGES_KEY = "challenges"
+LEGACY_TESTS_KEY = "tests"
+
+SCHEMA_VERSION = 1
+
+# key of a test object holding data that is stored next to the test instead of in its row
+TEST_ARTIFACTS_KEY = "_artifacts"
+
+# keys of a challenge object holding the (potentially huge) lists of the object pairs
+CHALLENGE_OBJECT_KEYS = ("originalObjects", "comparativeObjects", "targetDecisions")
+
+# number of object pairs of a challenge stored per row, streaming tests load one row at a time
+CHALLENGE_CHUNK_SIZE = 100000
+
+
+def _encode(oValue):
+    """serialize a python object to be stored in a BLOB column"""
+    return sqlite3.Binary(pickle.dumps(oValue, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _decode(bValue):
+    """deserialize a python object stored in a BLOB column"""
+    return pickle.loads(bytes(bValue))
+
+
+def _concat_objects(aParts):
+    """ concatenates the slices of a list of objects (or a numpy array) stored in several rows"""
+    if aParts and isinstance(aParts[0], np.ndarray):
+        return np.concatenate(aParts)
+    aObjects = []
+    for aPart in aParts:
+        aObjects.extend(aPart)
+    return aObjects
+
+
+def _split_challenge(dicChallenge):
+    """ splits a challenge object into its summary and the lists of object pairs"""
+    dicMetadata = {sKey: oValue for sKey, oValue in dicChallenge.items()
+                   if sKey not in CHALLENGE_OBJECT_KEYS and sKey != "challenge"}
+    tpObjects = tuple(dicChallenge[sKey] for sKey in CHALLENGE_OBJECT_KEYS)
+    aTargetDecisions = tpObjects[2]
+    lSize = len(aTargetDecisions)
+    lPositives = int(np.count_nonzero(np.asarray(aTargetDecisions, dtype=bool)))
+    return (lSize, lPositives, lSize - lPositives, dicMetadata), tpObjects
+
+
+class Storage(object):
+    """ Storage -- SQLite storage engine of Twizzle keeping one row per challenge and one row per test
+    """
+
+    def __init__(self, sDBPath):
+        """Constructor of the Storage class
+
+        Note:
+            Databases written by older versions of Twizzle (one pickled list of challenges and
+            one of tests in a sqlitedict table) are migrated in place the first time they are opened.
+        Args:
+            sDBPath (str): Path to the SQLite database.
+        """
+        if sDBPath is None:
+            raise Exception("Path to SQL-Database has to be defined")
+        self._lock = RLock()
+        self._conn = sqlite3.connect(
+            sDBPath, check_same_thread=False, timeout=60)
+        self.__create_schema()
+        self.__migrate_legacy_layout()
+
+    def __create_schema(self):
+        """ creates tables and indices if they do not exist yet"""
+        with self._lock, self._conn:
+            # summary of a challenge: name, set size, class counts and metadata
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS challenges ("
+                "name TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "positives INTEGER NOT NULL, "
+                "negatives INTEGER NOT NULL, "
+                "metadata BLOB NOT NULL)")
+            # lists of object pairs and target decisions, only loaded if really needed. Every row holds
+            # the slices of the lists starting at the pair "start", so they can be loaded chunk by chunk.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS challenge_objects ("
+                "name TEXT NOT NULL, "
+                "start INTEGER NOT NULL, "
+                "data BLOB NOT NULL, "
+                "PRIMARY KEY (name, start))")
+            # tests, marked with the fingerprint of the run they result from
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tests ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "challenge TEXT, "
+                "data BLOB NOT NULL, "
+                "fingerprint TEXT)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tests_challenge ON tests (challenge)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tests_fingerprint ON tests (fingerprint)")
+            # progress of streaming tests, one row per finished chunk
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "fingerprint TEXT NOT NULL, "
+                "chunk INTEGER NOT NULL, "
+                "data BLOB NOT NULL, "
+                "PRIMARY KEY (fingerprint, chunk))")
+            # bulky results of a test (e.g. ROC curves, per-pair decisions), only loaded on request.
+            # Artifacts are stored once by content, so tests of one threshold sweep share them.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifact_blobs ("
+                "digest TEXT PRIMARY KEY, "
+                "data BLOB NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS test_artifacts ("
+                "test_id INTEGER NOT NULL, "
+                "name TEXT NOT NULL, "
+                "digest TEXT NOT NULL, "
+                "PRIMARY KEY (test_id, name))")
+            self._conn.execute("PRAGMA user_version = %i" % SCHEMA_VERSION)
+
+    def __migrate_legacy_layout(self):
+        """ moves challenges and tests of the old single-key layout into the row layout"""
+        with self._lock:
+            if not self._conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                    (LEGACY_TABLENAME,)).fetchone():
+                return
+            dicLegacy = {}
+            for sKey in (LEGACY_CHALLENGES_KEY, LEGACY_TESTS_KEY):
+                tpRow = self._conn.execute(
+                    'SELECT value FROM "%s" WHERE key = ?' % LEGACY_TABLENAME, (sKey,)).fetchone()
+                if tpRow is not None:
+                    dicLegacy[sKey] = _decode(tpRow[0])
+            if not dicLegacy:
+                return
+
+            # import everything in one transaction and drop the legacy entries afterwards
+            with self._conn:
+                self.__import(dicLegacy.get(LEGACY_CHALLENGES_KEY, []),
+                              dicLegacy.get(LEGACY_TESTS_KEY, []))
+                self._conn.execute(
+                    'DELETE FROM "%s" WHERE key IN (?, ?)' % LEGACY_TABLENAME,
+                    (LEGACY_CHALLENGES_KEY, LEGACY_TESTS_KEY))
+
+    def __insert_artifact(self, lTestId, sName, bData, sDigest=None):
+        """ links an encoded artifact to a test, storing its content only once, without committing
+
+        Note:
+            Pass the digest (returned by an earlier call) instead of the data to link an artifact
+            that was inserted before without encoding and hashing it again.
+        """
+        if sDigest is None:
+            sDigest = hashlib.sha1(bData).hexdigest()
+            self._conn.execute(
+                "INSERT OR IGNORE INTO artifact_blobs (digest, data) VALUES (?, ?)", (sDigest, bData))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO test_artifacts (test_id, name, digest) VALUES (?, ?, ?)",
+            (lTestId, sName, sDigest))
+        return sDigest
+
+    def __insert_challenge(self, sName, dicChallenge, bReplace=False):
+        """ inserts summary and object lists of a challenge without committing"""
+        (lSize, lPositives, lNegatives, dicMetadata), tpObjects = _split_challenge(
+            dicChallenge)
+        sInsert = "INSERT OR REPLACE" if bReplace else "INSERT"
+        self._conn.execute(
+            sInsert + " INTO challenges (name, size, positives, negatives, metadata) VALUES (?, ?, ?, ?, ?)",
+            (sName, lSize, lPositives, lNegatives, _encode(dicMetadata)))
+        if bReplace:
+            self._conn.execute(
+                "DELETE FROM challenge_objects WHERE name = ?", (sName,))
+        # an empty challenge still gets one row
+        for lStart in range(0, max(lSize, 1), CHALLENGE_CHUNK_SIZE):
+            self._conn.execute(
+                "INSERT INTO challenge_objects (name, start, data) VALUES (?, ?, ?)",
+                (sName, lStart, _encode(tuple(aObjects[lStart:lStart + CHALLENGE_CHUNK_SIZE]
+                                              for aObjects in tpObjects))))
+
+    def __import(self, aChallenges, aTests):
+        """ inserts lists of challenge and test objects without committing"""
+        for dicChallenge in aChallenges:
+            self.__insert_challenge(
+                dicChallenge["challenge"], dicChallenge, bReplace=True)
+        for dicTest in aTests:
+            self._conn.execute(
+                "INSERT INTO tests (challenge, data) VALUES (?, ?)",
+                (dicTest.get("challenge"), _encode(dicTest)))
+
+    def import_sqlitedict(self, sPathToLegacyDB, sTablename=LEGACY_TABLENAME):
+        """ imports challenges and tests from a database written with the old sqlitedict layout
+
+        Args:
+            sPathToLegacyDB (str): Path to the sqlitedict database
+            sTablename (str): name of the sqlitedict table holding the data
+
+        Returns:
+            None
+        """
+        dbLegacy = SqliteDict(sPathToLegacyDB, tablename=sTablename, flag="r")
+        try:
+            aChallenges = dbLegacy.get(LEGACY_CHALLENGES_KEY, [])
+            aTests = dbLegacy.get(LEGACY_TESTS_KEY, [])
+        finally:
+            dbLegacy.close()
+        with self._lock, self._conn:
+            self.__import(aChallenges, aTests)
+
+    # challenges
+    def has_challenge(self, sName):
+        """ returns True if a challenge with the given name exists"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM challenges WHERE name = ?", (sName,)).fetchone() is not None
+
+    def add_challenge(self, sName, dicChallenge):
+        """ inserts a new challenge row, raises if the name is already in use"""
+        with self._lock, self._conn:
+            if self.has_challenge(sName):
+                raise Exception(
+                    "Challenge name %s is already in use. Define an other one. Aborting." % sName)
+            self.__insert_challenge(sName, dicChallenge)
+
+    def __build_challenge(self, sName, bMetadata):
+        """ reassembles a challenge object from its rows, the lock has to be held"""
+        dicChallenge = _decode(bMetadata)
+        dicChallenge["challenge"] = sName
+        aChunks = [_decode(bData) for (bData,) in self._conn.execute(
+            "SELECT data FROM challenge_objects WHERE name = ? ORDER BY start", (sName,)).fetchall()]
+        for i, sKey in enumerate(CHALLENGE_OBJECT_KEYS):
+            dicChallenge[sKey] = _concat_objects([tpChunk[i] for tpChunk in aChunks])
+        return dicChallenge
+
+    def get_challenge(self, sName):
+        """ returns the challenge object of the given name or None"""
+        with self._lock:
+            tpRow = self._conn.execute(
+                "SELECT metadata FROM challenges WHERE name = ?", (sName,)).fetchone()
+            return self.__build_challenge(sName, tpRow[0]) if tpRow else None
+
+    def get_challenges(self):
+        """ returns a list of all challenge objects in insertion order"""
+        with self._lock:
+            aRows = self._conn.execute(
+                "SELECT name, metadata FROM challenges ORDER BY rowid").fetchall()
+            return [self.__build_challenge(*tpRow) for tpRow in aRows]
+
+    def iter_challenge_objects(self, sName, lStart=0):
+        """ yields the lists of a challenge slice by slice, beginning with the slice holding pair lStart
+
+        Yields:
+            (lOffset, aOriginalObjects, aComparativeObjects, aTargetDecisions): index of the first pair of the
+            slice and the slices of the three lists
+        """
+        with self._lock:
+            tpRow = self._conn.execute(
+                "SELECT MAX(start) FROM challenge_objects WHERE name = ? AND start <= ?", (sName, lStart)).fetchone()
+        lNext = tpRow[0] if tpRow and tpRow[0] is not None else 0
+        while True:
+            # one row at a time, so only one slice is held in memory
+            with self._lock:
+                tpRow = self._conn.execute(
+                    "SELECT start, data FROM challenge_objects WHERE name = ? AND start >= ? ORDER BY start LIMIT 1",
+                    (sName, lNext)).fetchone()
+            if tpRow is None:
+                return
+            lOffset, bData = tpRow
+            yield (lOffset,) + tuple(_decode(bData))
+            lNext = lOffset + 1
+
+    def get_challenge_summary(self, sName):
+        """ returns name, set size, class counts and metadata of the challenge of the given name or None"""
+        aSummaries = self.__get_summaries("WHERE name = ?", (sName,))
+        return aSummaries[0] if aSummaries else None
+
+    def get_challenge_summaries(self):
+        """ returns name, set size, class counts and metadata of all challenges in insertion order"""
+        return self.__get_summaries()
+
+    def __get_summaries(self, sWhere="", tpParameters=()):
+        """ returns the summaries of the challenges selected by sWhere in insertion order"""
+        with self._lock:
+            aRows = self._conn.execute(
+                "SELECT name, size, positives, negatives, metadata FROM challenges %s ORDER BY rowid" % sWhere,
+                tpParameters).fetchall()
+        aSummaries = []
+        for sName, lSize, lPositives, lNegatives, bMetadata in aRows:
+            dicSummary = _decode(bMetadata)
+            dicSummary.update({"challenge": sName, "challenge_set_size": lSize,
+                               "challenge_positives": lPositives, "challenge_negatives": lNegatives})
+            aSummaries.append(dicSummary)
+        return aSummaries
+
+    def del_challenge(self, sName):
+        """ deletes a challenge row, returns False if there was none"""
+        with self._lock, self._conn:
+            oCursor = self._conn.execute(
+                "DELETE FROM challenges WHERE name = ?", (sName,))
+            self._conn.execute(
+                "DELETE FROM challenge_objects WHERE name = ?", (sName,))
+        return oCursor.rowcount > 0
+
+    def clear_challenges(self):
+        """ deletes all challenge rows"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM challenges")
+            self._conn.execute("DELETE FROM challenge_objects")
+
+    # tests
+    def add_test(self, dicTest, sFingerprint=None):
+        """ appends a test row and returns its id
+
+        Note:
+            Entries of the dictionary under TEST_ARTIFACTS_KEY are stored as artifacts
+            of the test in rows of their own.
+        """
+        return self.add_tests([dicTest], sFingerprint)[0]
+
+    def add_tests(self, aTests, sFingerprint=None):
+        """ appends the tests of one run in a single transaction and returns their ids
+
+        Note:
+            Checkpoints stored under sFingerprint are deleted in the same transaction,
+            so a run is either completed or can be resumed.
+        """
+        aTestIds = []
+        # the tests of a threshold sweep share their artifacts (e.g. the deviations), every
+        # artifact object is encoded and hashed only once, by id (aTests keeps them alive)
+        dicDigestOfArtifact = {}
+        with self._lock, self._conn:
+            for dicTest in aTests:
+                dicArtifacts = dicTest.get(TEST_ARTIFACTS_KEY) or {}
+                dicTest = {sKey: oValue for sKey, oValue in dicTest.items()
+                           if sKey != TEST_ARTIFACTS_KEY}
+                oCursor = self._conn.execute(
+                    "INSERT INTO tests (challenge, data, fingerprint) VALUES (?, ?, ?)",
+                    (dicTest.get("challenge"), _encode(dicTest), sFingerprint))
+                lTestId = oCursor.lastrowid
+                for sName, oArtifact in dicArtifacts.items():
+                    sDigest = dicDigestOfArtifact.get(id(oArtifact))
+                    if sDigest is None:
+                        dicDigestOfArtifact[id(oArtifact)] = self.__insert_artifact(
+                            lTestId, sName, _encode(oArtifact))
+                    else:
+                        self.__insert_artifact(lTestId, sName, None, sDigest)
+                aTestIds.append(lTestId)
+            if sFingerprint is not None:
+                self._conn.execute(
+                    "DELETE FROM checkpoints WHERE fingerprint = ?", (sFingerprint,))
+        return aTestIds
+
+    def has_test_fingerprint(self, sFingerprint):
+        """ returns True if tests of the run with the given fingerprint are stored"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM tests WHERE fingerprint = ? LIMIT 1", (sFingerprint,)).fetchone() is not None
+
+    def add_checkpoint(self, sFingerprint, lChunk, oData):
+        """ stores the result of a finished chunk of a streaming test"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (fingerprint, chunk, data) VALUES (?, ?, ?)",
+                (sFingerprint, lChunk, _encode(oData)))
+
+    def get_checkpoints(self, sFingerprint):
+        """ returns the results of all finished chunks of a streaming test in the order of the chunks"""
+        with self._lock:
+            aRows = self._conn.execute(
+                "SELECT data FROM checkpoints WHERE fingerprint = ? ORDER BY chunk", (sFingerprint,)).fetchall()
+        return [_decode(bData) for (bData,) in aRows]
+
+    def get_tests(self, sChallengeName=None):
+        """ returns all tests in insertion order, optionally only those of one challenge"""
+        with self._lock:
+            if sChallengeName is None:
+                aRows = self._conn.execute(
+                    "SELECT id, data FROM tests ORDER BY id").fetchall()
+            else:
+                aRows = self._conn.execute(
+                    "SELECT id, data FROM tests WHERE challenge = ? ORDER BY id", (sChallengeName,)).fetchall()
+        aTests = []
+        for lTestId, bData in aRows:
+            dicTest = _decode(bData)
+            dicTest["test_id"] = lTestId
+            aTests.append(dicTest)
+        return aTests
+
+    def get_test(self, lTestId):
+        """ returns the test object of the given id or None"""
+        with self._lock:
+            tpRow = self._conn.execute(
+                "SELECT data FROM tests WHERE id = ?", (lTestId,)).fetchone()
+        if tpRow is None:
+            return None
+        dicTest = _decode(tpRow[0])
+        dicTest["test_id"] = lTestId
+        return dicTest
+
+    def add_artifact_data(self, oArtifact):
+        """ stores the content of an artifact on its own and returns its digest
+
+        Note:
+            Used for artifacts written part by part while a test runs (e.g. the decisions of every chunk
+            of a streaming test). The test refers to the parts by their digests.
+        """
+        bData = _encode(oArtifact)
+        sDigest = hashlib.sha1(bData).hexdigest()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO artifact_blobs (digest, data) VALUES (?, ?)", (sDigest, bData))
+        return sDigest
+
+    def get_artifact_data(self, sDigest):
+        """ returns the content of an artifact stored by add_artifact_data or None"""
+        with self._lock:
+            tpRow = self._conn.execute(
+                "SELECT data FROM artifact_blobs WHERE digest = ?", (sDigest,)).fetchone()
+        return _decode(tpRow[0]) if tpRow else None
+
+    def get_test_artifacts(self, sName, lTestId=None):
+        """ returns a dictionary mapping test ids to their artifact of the given name"""
+        with self._lock:
+            if lTestId is None:
+                aRows = self._conn.execute(
+                    "SELECT a.test_id, a.digest, b.data FROM test_artifacts a JOIN artifact_blobs b ON b.digest = a.digest "
+                    "WHERE a.name = ? ORDER BY a.test_id", (sName,)).fetchall()
+            else:
+                aRows = self._conn.execute(
+                    "SELECT a.test_id, a.digest, b.data FROM test_artifacts a JOIN artifact_blobs b ON b.digest = a.digest "
+                    "WHERE a.name = ? AND a.test_id = ?", (sName, lTestId)).fetchall()
+        # decode shared artifacts only once
+        dicDecoded = {}
+        dicArtifacts = {}
+        for lId, sDigest, bData in aRows:
+            if sDigest not in dicDecoded:
+                dicDecoded[sDigest] = _decode(bData)
+            dicArtifacts[lId] = dicDecoded[sDigest]
+        return dicArtifacts
+
+    def clear_tests(self):
+        """ deletes all test rows"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tests")
+            self._conn.execute("DELETE FROM test_artifacts")
+            self._conn.execute("DELETE FROM artifact_blobs")
+            self._conn.execute("DELETE FROM checkpoints")
+
+    def close(self):
+        """ closes the database connection"""
+        with self._lock:
+            self._conn.close()
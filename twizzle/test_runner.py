@@ -1,52 +1,276 @@
+import itertools
+import pickle
+from functools import partial
+from queue import Queue
 from twizzle import Twizzle
+from twizzle.storage import TEST_ARTIFACTS_KEY
+from twizzle.cache import flush_process_caches
+from twizzle.fingerprint import calc_test_fingerprint
+from multiprocessing import Pool
 from multiprocessing.pool import ThreadPool
 from threading import Lock
 
+BACKEND_THREADS = "threads"
+BACKEND_PROCESSES = "processes"
+BACKEND_INLINE = "inline"
+BACKENDS = (BACKEND_THREADS, BACKEND_PROCESSES, BACKEND_INLINE)
+
+# Twizzle instance of a worker process of the process backend
+_oWorkerTwizzle = None
+
+
+def _init_worker(sDBPath):
+    """open a database handle per worker process"""
+    global _oWorkerTwizzle
+    _oWorkerTwizzle = Twizzle(sDBPath)
+
+
+def _run_test_in_worker(sChallengeName, fnCallback, dicCallbackParameters, dicRunOptions):
+    """run a test in a worker process and send the test object back to the parent"""
+    try:
+        return _oWorkerTwizzle.run_test(sChallengeName, fnCallback, dicCallbackParameters, **dicRunOptions)
+    finally:
+        # make the new entries of the caches of this worker available to the others
+        flush_process_caches()
+
 
 class TestRunner(object):
     """ TestRunner - creates a multi threaded environment for running tests
     """
 
-    def __init__(self, sDBPath, lNrOfThreads=2):
+    def __init__(self, sDBPath, lNrOfThreads=2, sBackend=BACKEND_THREADS, bResume=False):
         """Constructor of a TestRunner class
 
         Note:
-            Please define the `DB_PATH` in the config.py or pass the path of the SQLite 
+            Please define the `DB_PATH` in the config.py or pass the path of the SQLite
             as parameter
+
+            The backend defines how tests are executed:
+            - "threads": tests run in a pool of threads of this process
+            - "processes": tests run in a pool of worker processes. Use it for wrappers
+                           that spend most of their time holding the GIL. The callback and all of
+                           its parameters have to be picklable (e.g. functions defined on module level).
+                           Every worker opens its own database handle and gets its own handle of every
+                           Cache passed as parameter. The test results are sent back and saved by this process.
+            - "inline": tests run one after another directly in run_test_async (useful for debugging)
+
+            Every test is saved as soon as it is done, marked with the fingerprint of its run (challenge,
+            callback and parameters, see fingerprint.calc_test_fingerprint). With bResume tests whose
+            fingerprint is found in the database are not run again and streaming tests (see lChunkSize of
+            run_test_async) checkpoint every finished chunk, so an interrupted sweep continues where it stopped
+            when the same script is run again.
         Args:
             sDBPath (str): Path to the SQLite database.
-            lNrOfThreads (int): number of threads to use for the tests
+            lNrOfThreads (int): number of threads (or worker processes) to use for the tests
+            sBackend (str): execution backend, one of "threads", "processes" or "inline"
+            bResume (bool): skip completed tests and resume interrupted streaming tests
         """
         if sDBPath is None:
             raise Exception("Path to SQL-Database has to be defined")
         if lNrOfThreads <= 0:
             raise Exception("lNrOfThreads has to be grater then 0")
+        if sBackend not in BACKENDS:
+            raise Exception("Backend has to be one of %s" % ", ".join(BACKENDS))
         self.tw = Twizzle(sDBPath)
-        self.oPool = ThreadPool(processes=lNrOfThreads)
-        self.aTaskPoolThreads = []
+        self.sBackend = sBackend
+        self.bResume = bResume
+        if sBackend == BACKEND_THREADS:
+            self.oPool = ThreadPool(processes=lNrOfThreads)
+        elif sBackend == BACKEND_PROCESSES:
+            self.oPool = Pool(processes=lNrOfThreads,
+                              initializer=_init_worker, initargs=(sDBPath,))
+        else:
+            self.oPool = None
+        # finished tests (or errors) in the order of completion
+        self.queueFinished = Queue()
+        self.lNrOfPendingTests = 0
         self.lock = Lock()
 
-    def run_test_async(self, sChallengeName, fnCallback, dicCallbackParameters={}):
+    def run_test_async(self, sChallengeName, fnCallback, dicCallbackParameters={}, aThresholds=None,
+                       bStorePairResults=True, bDeduplicateObjects=False, lChunkSize=None):
         """add test run to threadpool
 
         Args:
             sChallengeName (str): name of the challenge that should be tested
             fnCallback (function): test wrapper function that should be called
             dicCallbackParameters (:obj:): Dictionary of parameters for  fnCallback
+            aThresholds (:obj:`list` of :obj:`float`): optional thresholds to evaluate on the deviations
+                                                     returned by fnCallback (see Twizzle.run_test), every
+                                                     threshold results in a test of its own
+            bStorePairResults (bool): keep the decision (and deviation) of every object pair with the test
+            bDeduplicateObjects (bool): call fnCallback with the distinct objects of the challenge and index
+                                        arrays of the pairs (see Twizzle.run_test)
+            lChunkSize (int): fnCallback is a streaming callback getting the pairs in chunks of this size
+                              (see Twizzle.run_test)
+
+        Returns:
+            str: the fingerprint of the test run (None if the callback can not be identified, e.g. a lambda
+                 function, which is not allowed with bResume)
+        """
+        # further arguments of Twizzle.run_test
+        dicRunOptions = {"aThresholds": aThresholds,
+                         "bStorePairResults": bStorePairResults,
+                         "bDeduplicateObjects": bDeduplicateObjects,
+                         "lChunkSize": lChunkSize}
+        try:
+            sFingerprint = calc_test_fingerprint(
+                sChallengeName, fnCallback, dicCallbackParameters, dicRunOptions)
+        except Exception:
+            # a run that can not be identified would be taken for another one
+            if self.bResume:
+                raise
+            sFingerprint = None
+        if self.bResume:
+            if self.tw.is_test_completed(sFingerprint):
+                return sFingerprint
+            # streaming tests checkpoint their chunks under the fingerprint
+            dicRunOptions["sFingerprint"] = sFingerprint
+        fnOnTestFinished = partial(self.__on_test_finished, sFingerprint)
+        with self.lock:
+            self.lNrOfPendingTests += 1
+        if self.sBackend == BACKEND_THREADS:
+            self.oPool.apply_async(
+                self.tw.run_test, (sChallengeName, fnCallback,
+                                   dicCallbackParameters), dicRunOptions,
+                callback=fnOnTestFinished, error_callback=self.__on_test_failed)
+        elif self.sBackend == BACKEND_PROCESSES:
+            # fail early and in the calling process if the task can not be sent to a worker
+            try:
+                pickle.dumps((fnCallback, dicCallbackParameters))
+            except Exception as e:
+                with self.lock:
+                    self.lNrOfPendingTests -= 1
+                raise Exception(
+                    "Callback and parameters have to be picklable for the process backend: %s" % e)
+            self.oPool.apply_async(
+                _run_test_in_worker, (sChallengeName, fnCallback,
+                                      dicCallbackParameters, dicRunOptions),
+                callback=fnOnTestFinished, error_callback=self.__on_test_failed)
+        else:
+            try:
+                oResult = self.tw.run_test(
+                    sChallengeName, fnCallback, dicCallbackParameters, **dicRunOptions)
+            except Exception as e:
+                self.__on_test_failed(e)
+            else:
+                fnOnTestFinished(oResult)
+        return sFingerprint
+
+    def sweep(self, aChallengeNames, fnCallback, dicGrid, dicCallbackParameters=None, sThresholdParameter="lThreshold",
+              bStorePairResults=True, bDeduplicateObjects=False, lChunkSize=None):
+        """add tests for every point of a parameter grid on every given challenge
+
+        Note:
+            The grid maps parameter names of fnCallback to lists of values, every combination of values
+            is a grid point. Values of sThresholdParameter only change the decision, not the features
+            the callback calculates. Grid points differing only in the threshold are therefore run as
+            one test with the threshold parameter set to None, fnCallback has to return the deviations then.
+            All thresholds are evaluated on them at once (see aThresholds of run_test_async) and every
+            grid point results in a test of its own. The features of a challenge are thus calculated once
+            per combination of the other parameters instead of once per grid point.
+
+        Args:
+            aChallengeNames (:obj:`list` of :obj:`str`): names of the challenges to test (or a single name)
+            fnCallback (function): test wrapper function that should be called
+            dicGrid (:obj:): dictionary mapping parameter names of fnCallback to lists of values
+            dicCallbackParameters (:obj:): further parameters of fnCallback that are the same for all grid points
+            sThresholdParameter (str): name of the parameter of fnCallback holding the threshold
+            bStorePairResults (bool): keep the decision (and deviation) of every object pair with the tests
+            bDeduplicateObjects (bool): see run_test_async
+            lChunkSize (int): see run_test_async
 
         Returns:
-            None
+            :obj:`list` of :obj:`str`: the fingerprints of the submitted test runs
+
+        Example:
+            oRunner.sweep(["challenge_1", "challenge_2"], test_aHash,
+                          {"lHashSize": [8, 16, 32], "lThreshold": [0.1, 0.15, 0.2]}, {"oCache": oCache})
+            results in 6 runs of test_aHash and 18 tests
         """
-        pThread = self.oPool.apply_async(
-            self.tw.run_test, (sChallengeName, fnCallback, dicCallbackParameters))
-        self.aTaskPoolThreads.append(pThread)
+        if isinstance(aChallengeNames, str):
+            aChallengeNames = [aChallengeNames]
+        dicGrid = dict(dicGrid)
+        aThresholds = dicGrid.pop(sThresholdParameter, None)
+        aNames = list(dicGrid)
+
+        aFingerprints = []
+        for tpValues in itertools.product(*[dicGrid[sName] for sName in aNames]):
+            dicParameters = dict(dicCallbackParameters or {})
+            dicParameters.update(zip(aNames, tpValues))
+            if aThresholds is not None:
+                # the callback returns deviations, all thresholds are evaluated on them
+                dicParameters[sThresholdParameter] = None
+            for sChallengeName in aChallengeNames:
+                aFingerprints.append(self.run_test_async(
+                    sChallengeName, fnCallback, dicParameters, aThresholds=aThresholds,
+                    bStorePairResults=bStorePairResults, bDeduplicateObjects=bDeduplicateObjects,
+                    lChunkSize=lChunkSize))
+        return aFingerprints
+
+    def __on_test_finished(self, sFingerprint, oResult):
+        """called as soon as a test is done, saves its results right away"""
+        # threshold sweeps result in a list of tests
+        aTests = oResult if isinstance(oResult, list) else [oResult]
+        try:
+            aTestIds = self.tw.save_tests(aTests, sFingerprint)
+        except Exception as e:
+            self.queueFinished.put((None, e))
+            return
+        # queue the rows as saved, the artifacts (e.g. the results of every pair) are only kept in the database
+        aSavedTests = []
+        for lTestId, dicTest in zip(aTestIds, aTests):
+            dicSavedTest = {sKey: oValue for sKey, oValue in dicTest.items() if sKey != TEST_ARTIFACTS_KEY}
+            dicSavedTest["test_id"] = lTestId
+            aSavedTests.append(dicSavedTest)
+        self.queueFinished.put((aSavedTests, None))
+
+    def __on_test_failed(self, oError):
+        """called as soon as a test raised an exception"""
+        self.queueFinished.put((None, oError))
+
+    def iter_finished_tests(self):
+        """yield test results in the order the tests finish
+
+        Note:
+            Every result is saved to the database as soon as its test is done, no matter whether
+            tests submitted earlier are still running or whether results are iterated at all.
+            If tests failed, the first exception is raised after all other results have been yielded.
+
+        Yields:
+            dicTest: the test object of every finished test as saved to the database (with its test_id,
+                     without artifacts, see Twizzle.get_test_artifacts)
+        """
+        aErrors = []
+        while True:
+            with self.lock:
+                if self.lNrOfPendingTests == 0:
+                    break
+            aTests, oError = self.queueFinished.get()
+            with self.lock:
+                self.lNrOfPendingTests -= 1
+            if oError is not None:
+                aErrors.append(oError)
+                continue
+            for dicTest in aTests:
+                yield dicTest
+        if aErrors:
+            raise aErrors[0]
 
     def wait_till_tests_finished(self):
-        """block execution till all threads are done"""
-        # catch threads ready
-        for pThread in self.aTaskPoolThreads:
-            dicTest = pThread.get()
-            self.tw.save_test_threadsafe(dicTest, self.lock)
+        """block execution till all threads are done
+
+        Note:
+            Results are saved in the order the tests finish.
+        """
+        for _ in self.iter_finished_tests():
+            pass
+
+    def close(self):
+        """wait for all tests to be saved and shut down the pool"""
+        self.wait_till_tests_finished()
+        if self.oPool is not None:
+            self.oPool.close()
+            self.oPool.join()
 
     def get_tests(self):
         """get all tests defined"""
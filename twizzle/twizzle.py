@@ -1,10 +1,48 @@
 #!/usr/bin/env python3
 
-from sqlitedict import SqliteDict
 import numpy as np
+from collections import deque
+from twizzle.storage import Storage, TEST_ARTIFACTS_KEY
+from twizzle.metrics import calc_confusion_counts, calc_threshold_confusion_counts, calc_metrics, calc_roc, \
+    pack_decisions, unpack_decisions
 
-DB_CHALLENGES_KEY = 'challenges'
-DB_TESTS_KEY = 'tests'
+# scalar values of the ROC analysis that are saved with every test of a threshold sweep
+ROC_SUMMARY_KEYS = ("AUC", "EER", "EER_threshold", "optimal_threshold")
+
+
+def deduplicate_objects(aOriginalObjects, aComparativeObjects):
+    """ builds a table of the distinct objects of a challenge and refers to them by index
+
+    Note:
+        The objects are listed in the order of their first occurrence.
+
+    Returns:
+        (aObjects, aOriginalIndices, aComparativeIndices): list of the distinct objects and two integer
+        arrays such that aObjects[aOriginalIndices[i]] is the i-th original object and
+        aObjects[aComparativeIndices[i]] the i-th comparative object
+    """
+    dicIndexOfObject = {}
+    aOriginalIndices = np.fromiter((dicIndexOfObject.setdefault(oObject, len(dicIndexOfObject))
+                                    for oObject in aOriginalObjects), dtype=np.int64, count=len(aOriginalObjects))
+    aComparativeIndices = np.fromiter((dicIndexOfObject.setdefault(oObject, len(dicIndexOfObject))
+                                       for oObject in aComparativeObjects), dtype=np.int64,
+                                      count=len(aComparativeObjects))
+    return list(dicIndexOfObject), aOriginalIndices, aComparativeIndices
+
+
+def _as_decisions(aDecisions):
+    """ returns the results of a callback as boolean array, raises if they are not boolean decisions
+
+    Note:
+        Deviations (e.g. hamming distances) would otherwise silently be taken as decisions
+        when no thresholds are given to evaluate them.
+    """
+    aDecisions = np.asarray(aDecisions)
+    if aDecisions.size > 0 and aDecisions.dtype != bool:
+        raise Exception(
+            "Callback returned values of type %s instead of boolean decisions. "
+            "Pass aThresholds to evaluate deviations." % aDecisions.dtype)
+    return aDecisions.astype(bool)
 
 
 class Twizzle(object):
@@ -22,7 +60,7 @@ class Twizzle(object):
         """
         if sDBPath is None:
             raise Exception("Path to SQL-Database has to be defined")
-        self._db = SqliteDict(sDBPath)
+        self._db = Storage(sDBPath)
 
     def add_challenge(self, sName, aOriginalObjects, aComparativeObjects, aTargetDecisions, dicMetadata={}):
         """Adds a challenge under the given name to the database
@@ -64,13 +102,8 @@ class Twizzle(object):
         if (not all(isinstance(x, bool) for x in aTargetDecisions)) and not isinstance(aTargetDecisions, np.ndarray) and not (aTargetDecisions.dtype == np.dtype("bool")):
             raise Exception("The target decisions have to be boolean only.")
 
-        # get current challenges from database
-        aChallenges = self._db.get(DB_CHALLENGES_KEY, [])
-
         # test whether name was used before
-        aChallengesSameName = [
-            ch for ch in aChallenges if ch["challenge"] == sName]
-        if len(aChallengesSameName) != 0:
+        if self._db.has_challenge(sName):
             raise Exception(
                 "Challenge name %s is already in use. Define an other one. Aborting." % sName)
 
@@ -80,9 +113,7 @@ class Twizzle(object):
         # adding additional information if given
         if dicMetadata:
             dicChallenge = {**dicMetadata, **dicChallenge}
-        aChallenges.append(dicChallenge)
-        self._db[DB_CHALLENGES_KEY] = aChallenges
-        self._db.commit()
+        self._db.add_challenge(sName, dicChallenge)
 
     def del_challenge(self, sName):
         """ deletes an existing challenge by its name
@@ -94,26 +125,31 @@ class Twizzle(object):
             None
         """
 
-        # get current challenges from database
-        aChallenges = self._db.get(DB_CHALLENGES_KEY, [])
-        aMatches = [ch for ch in aChallenges if ch["challenge"] == sName]
-        if len(aMatches) == 0:
+        if not self._db.del_challenge(sName):
             raise Exception("No challenge named %s found." % sName)
 
-        # remove element
-        aChallenges.remove(aMatches[0])
-
-        # save new db
-        self._db[DB_CHALLENGES_KEY] = aChallenges
-        self._db.commit()
-
     def get_challenges(self):
         """ getting a list of all defined challenges
 
         Returns:
             :obj:`list` of :obj:: `obj`:  List of all defined challenges
         """
-        return self._db.get(DB_CHALLENGES_KEY, [])
+        return self._db.get_challenges()
+
+    def get_challenge_summaries(self):
+        """ getting a lightweight list of all defined challenges
+
+        Note:
+            In contrast to get_challenges the lists of objects and target decisions are not loaded.
+            Every summary holds the name of the challenge, its metadata and the keys
+            `challenge_set_size`, `challenge_positives` and `challenge_negatives` giving the number of
+            object pairs, the number of pairs that should be matched and the number of pairs that
+            should not be matched.
+
+        Returns:
+            :obj:`list` of :obj:: `obj`:  List of summaries of all defined challenges
+        """
+        return self._db.get_challenge_summaries()
 
     def get_challenge(self, sChallengeName):
         """ getting a single challenge object
@@ -124,20 +160,19 @@ class Twizzle(object):
           Returns:
             :obj:: `obj`:  Object defining the challenge having the name sChallengeName
         """
-        aChallenges = self._db.get(DB_CHALLENGES_KEY, [])
-        aMatches = [ch for ch in aChallenges if ch["challenge"]
-                    == sChallengeName]
-        if len(aMatches) == 0:
+        dicChallenge = self._db.get_challenge(sChallengeName)
+        if dicChallenge is None:
             raise Exception("No challenge with name %s found." %
                             sChallengeName)
-        return aMatches[0]
+        return dicChallenge
 
     def clear_challenges(self):
         """ clears all challenge entries from the database """
-        self._db[DB_CHALLENGES_KEY] = []
-        self._db.commit()
+        self._db.clear_challenges()
 
-    def run_test(self, sChallengeName, fnCallback, dicCallbackParameters={}, autosave_to_db=False):
+    def run_test(self, sChallengeName, fnCallback, dicCallbackParameters={}, autosave_to_db=False, aThresholds=None,
+                 bStorePairResults=True, oDeviationDtype=np.float32, bDeduplicateObjects=False, lChunkSize=None,
+                 sFingerprint=None):
         """ run single challenge as test using given callback function and optional params
 
         Note:
@@ -156,19 +191,71 @@ class Twizzle(object):
             - dicAdditionalInformation: the algorithm can supply additional information that can be used in the evaluation
                                         later on to compare different settings
 
+            If aThresholds is given, fnCallback has to return the deviation of every object pair
+            (e.g. the normalized hamming distance of two hashes) instead of boolean decisions.
+            Every threshold is then evaluated on these deviations in one pass, an object pair is considered
+            to be the same if its deviation is smaller than or equal to the threshold. This way a whole
+            threshold sweep only runs the algorithm once. Additionally the ROC curve of the deviations
+            is calculated. Its AUC, equal error rate (EER), the threshold at the EER and the optimal
+            threshold are added to every test, the curve itself is saved as artifact "roc" of the test
+            (see get_test_artifacts).
+
+            If bDeduplicateObjects is set, fnCallback gets a table of the distinct objects of the challenge and
+            the indices of the original and comparative object of every pair into this table instead:
+            fnCallback(aObjects, aOriginalIndices, aComparativeIndices, **dicCallbackParameters)
+            This way a callback can process every object only once, even if it occurs in many pairs, and
+            compare the pairs by index (aOriginalIndices and aComparativeIndices are integer numpy arrays).
+
+            If lChunkSize is given, fnCallback is a streaming callback. It gets an iterator over the object pairs
+            in chunks of lChunkSize pairs and yields the results of every chunk as soon as they are calculated:
+            for aDecisions, dicAdditionalInformation in fnCallback(oChunks, **dicCallbackParameters)
+            - oChunks: iterator of (aOriginalObjects, aComparativeObjects) tuples holding one chunk each
+            - aDecisions: decisions (or deviations, if aThresholds is given) of the pairs of one chunk
+            - dicAdditionalInformation: metadata, the one yielded last is saved with the test
+            The object pairs are loaded from the database and the confusion counts accumulated chunk by chunk,
+            so neither the whole challenge nor all decisions or deviations have to be held in memory. The ROC
+            curve needs all deviations at once and is not calculated, neither are the deviations stored.
+            If bStorePairResults is set, the bit-packed decisions of every chunk are written to the database
+            as soon as the chunk is done.
+            If sFingerprint is given, the result of every finished chunk is checkpointed in the database under
+            it. Running the test again with the same fingerprint resumes after the last finished chunk.
+
+            Every test contains the raw confusion counts TP, TN, FP and FN. If bStorePairResults is set, the
+            decision of every object pair is kept bit-packed as artifact "decisions" (see get_test_pair_results),
+            the deviations of a threshold sweep as artifact "deviations". This allows to calculate further
+            metrics or to analyse single errors later on without running the algorithm again.
+
 
         Args:
             sChallengeName (str): the challenge that should be executed
             fnCallback (function): Pointer to wrapper-function that tests a challenge on a specific algorithm
                                     and makes decisions whether the objects are the same or not depending on its decision algorithm
             dicCallbackParameters (:obj:): Dictionary defining parameters for the function in fnCallback
+            aThresholds (:obj:`list` of :obj:`float`): optional thresholds to evaluate on the deviations returned by fnCallback
+            bStorePairResults (bool): keep the decision (and deviation) of every object pair with the test
+            oDeviationDtype (:obj:`numpy.dtype`): data type the deviations are stored with (e.g. numpy.float16 to save space)
+            bDeduplicateObjects (bool): call fnCallback with the distinct objects and index arrays (see above)
+            lChunkSize (int): run fnCallback as streaming callback on chunks of this many pairs (a multiple of 8)
+            sFingerprint (str): identifies the run (see fingerprint.calc_test_fingerprint), tests saved by
+                                autosave_to_db are marked with it and streaming tests are checkpointed under it
 
         Returns:
             dicTest: dictionary of test results that can be saved to db
+                     (a list of them, one per threshold, if aThresholds is given)
         """
         if not(sChallengeName) or not(fnCallback):
             raise Exception("Parameters are not allowed to be None.")
 
+        if lChunkSize is not None:
+            if bDeduplicateObjects:
+                raise Exception(
+                    "Streaming callbacks can not be combined with deduplicated objects.")
+            oResult = self.__run_streaming_test(sChallengeName, fnCallback, dicCallbackParameters, aThresholds,
+                                                bStorePairResults, lChunkSize, sFingerprint)
+            if autosave_to_db:
+                self.save_tests(oResult if isinstance(oResult, list) else [oResult], sFingerprint)
+            return oResult
+
         dicChallenge = self.get_challenge(sChallengeName)
         sChallengeName = dicChallenge["challenge"]
         aOriginalObjects = dicChallenge["originalObjects"]
@@ -176,70 +263,204 @@ class Twizzle(object):
         aTargetDecisions = dicChallenge["targetDecisions"]
 
         # run challenge
-        aDecisions, dicAdditionalInformation = fnCallback(
-            aOriginalObjects, aComparativeObjects, **dicCallbackParameters)
+        if bDeduplicateObjects:
+            aObjects, aOriginalIndices, aComparativeIndices = deduplicate_objects(
+                aOriginalObjects, aComparativeObjects)
+            aDecisions, dicAdditionalInformation = fnCallback(
+                aObjects, aOriginalIndices, aComparativeIndices, **dicCallbackParameters)
+        else:
+            aDecisions, dicAdditionalInformation = fnCallback(
+                aOriginalObjects, aComparativeObjects, **dicCallbackParameters)
 
         # check if site of decisions is right
         if len(aDecisions) != len(aTargetDecisions):
             raise Exception(
                 "Array of Decisions is not the same size as given set of objects. Aborting.")
 
-        # calculate rates
-        lTP = np.sum(np.logical_and(
-            aDecisions, aTargetDecisions))
-        lTN = np.sum(np.logical_and(
-            np.logical_not(aDecisions), np.logical_not(aTargetDecisions)))
-        lFP = np.sum(np.logical_and(
-            aDecisions, np.logical_not(aTargetDecisions)))
-        lFN = np.sum(np.logical_and(
-            np.logical_not(aDecisions), aTargetDecisions))
-
-        #True positive Rate / Recall -- Robustness in PIH
-        dTPR = lTP / (lTP + lFN) if ((lTP+lFN)>0) else 0.
-        # True negative Rate -- Sensitivity
-        dTNR = lTN / (lTN + lFP) if ((lTN+lFP)>0) else 0.
-        # False positive Rate / FAR
-        dFPR = 1 - dTNR
-        # False negative Rate / FRR
-        dFNR = 1 - dTPR
-
-        dAccuracy = (lTP+lTN)/(lTP+lTN+lFP+lFN)
-        dPrecision = lTP/(lTP+lFP) if ((lTP+lFP) > 0.) else 0.
-        dF1score = 2*((dPrecision*dTPR)/(dPrecision+dTPR)) if ((dPrecision+dTPR)>0) else 0.
-
-
-        # fill test object
-        dicTest = dicAdditionalInformation
-        dicTest["challenge"] = sChallengeName
-        #dicTest["TP"] = lTP
-        #dicTest["TN"] = lTN
-        #dicTest["FP"] = lFP
-        #dicTest["FN"] = lFN
-        dicTest["TPR"] = dTPR #Recall
-        dicTest["TNR"] = dTNR
-        dicTest["FPR"] = dFPR # FAR
-        dicTest["FNR"] = dFNR #FRR
-
-        dicTest["Accuracy"] = dAccuracy
-        dicTest["Precision"] = dPrecision
-        dicTest["F1_score"] = dF1score
-
-
-        # save test in db
+        if aThresholds is None:
+            # calculate rates
+            aDecisions = _as_decisions(aDecisions)
+            lTP, lTN, lFP, lFN = calc_confusion_counts(
+                aDecisions, aTargetDecisions)
+
+            # fill test object
+            dicTest = dicAdditionalInformation
+            dicTest["challenge"] = sChallengeName
+            dicTest["TP"] = lTP
+            dicTest["TN"] = lTN
+            dicTest["FP"] = lFP
+            dicTest["FN"] = lFN
+            dicTest.update(calc_metrics(lTP, lTN, lFP, lFN))
+            if bStorePairResults:
+                dicTest[TEST_ARTIFACTS_KEY] = {
+                    "decisions": pack_decisions(aDecisions)}
+
+            # save test in db
+            if autosave_to_db:
+                self.save_tests([dicTest], sFingerprint)
+
+            return dicTest
+
+        # evaluate all thresholds on the deviations at once
+        aThresholds = np.atleast_1d(np.asarray(aThresholds, dtype=np.float64))
+        aTP, aTN, aFP, aFN = calc_threshold_confusion_counts(
+            aDecisions, aTargetDecisions, aThresholds)
+        dicROC = calc_roc(aDecisions, aTargetDecisions)
+        dicROCCurve = {sKey: dicROC[sKey] for sKey in ("thresholds", "FPR", "TPR")}
+        aDeviations = np.asarray(aDecisions)
+        if bStorePairResults:
+            # the same object for all thresholds, so it is stored only once
+            aStoredDeviations = aDeviations.astype(oDeviationDtype)
+        aTests = []
+        for i, dThreshold in enumerate(aThresholds):
+            dicTest = dict(dicAdditionalInformation)
+            dicTest["challenge"] = sChallengeName
+            dicTest["threshold"] = float(dThreshold)
+            dicTest["TP"] = int(aTP[i])
+            dicTest["TN"] = int(aTN[i])
+            dicTest["FP"] = int(aFP[i])
+            dicTest["FN"] = int(aFN[i])
+            dicTest.update(calc_metrics(
+                dicTest["TP"], dicTest["TN"], dicTest["FP"], dicTest["FN"]))
+            for sKey in ROC_SUMMARY_KEYS:
+                dicTest[sKey] = dicROC[sKey]
+            dicTest[TEST_ARTIFACTS_KEY] = {"roc": dicROCCurve}
+            if bStorePairResults:
+                dicTest[TEST_ARTIFACTS_KEY]["decisions"] = pack_decisions(
+                    aDeviations <= dThreshold)
+                dicTest[TEST_ARTIFACTS_KEY]["deviations"] = aStoredDeviations
+            aTests.append(dicTest)
+
+        # save tests in db
         if autosave_to_db:
-            self.__save_test(dicTest)
+            self.save_tests(aTests, sFingerprint)
+
+        return aTests
+
+    def __run_streaming_test(self, sChallengeName, fnCallback, dicCallbackParameters, aThresholds,
+                             bStorePairResults, lChunkSize, sFingerprint):
+        """ runs a streaming callback chunk by chunk and accumulates the confusion counts (see run_test)"""
+        if lChunkSize <= 0 or lChunkSize % 8 != 0:
+            # chunks of whole bytes can be packed on their own
+            raise Exception("Chunk size has to be a positive multiple of 8.")
+        dicSummary = self._db.get_challenge_summary(sChallengeName)
+        if dicSummary is None:
+            raise Exception("No challenge with name %s found." % sChallengeName)
+        lNrOfPairs = dicSummary["challenge_set_size"]
+        if aThresholds is not None:
+            aThresholds = np.atleast_1d(np.asarray(aThresholds, dtype=np.float64))
+        lNrOfTests = 1 if aThresholds is None else aThresholds.size
+
+        # TP, TN, FP and FN of every test
+        aCounts = np.zeros((4, lNrOfTests), dtype=np.int64)
+        # digests of the packed decisions of every chunk, the decisions themselves are in the database
+        aDecisionDigests = [[] for _ in range(lNrOfTests)]
+        dicAdditionalInformation = {}
+        lOffset = 0
+
+        # resume after the last chunk finished by an earlier run
+        if sFingerprint is not None:
+            for dicCheckpoint in self._db.get_checkpoints(sFingerprint):
+                aCounts += dicCheckpoint["counts"]
+                for i, sDigest in enumerate(dicCheckpoint["digests"]):
+                    aDecisionDigests[i].append(sDigest)
+                dicAdditionalInformation = dicCheckpoint["metadata"]
+                lOffset += dicCheckpoint["size"]
+        lFirstPair = lOffset
+
+        # target decisions of the chunks handed to the callback but not evaluated yet
+        queueTargets = deque()
+
+        def iter_chunks():
+            """slices the lists stored in the database into chunks of lChunkSize pairs"""
+            # pairs of the previous slice not handed to the callback yet (less than a chunk)
+            aBuffers = [[], [], []]
+            for tpSlice in self._db.iter_challenge_objects(sChallengeName, lFirstPair):
+                # drop the pairs of the first slice finished before
+                lSkip = max(0, lFirstPair - tpSlice[0])
+                aBuffers = [aBuffer + list(aSlice[lSkip:]) for aBuffer, aSlice in zip(aBuffers, tpSlice[1:])]
+                lPosition = 0
+                while len(aBuffers[0]) - lPosition >= lChunkSize:
+                    queueTargets.append(aBuffers[2][lPosition:lPosition + lChunkSize])
+                    yield aBuffers[0][lPosition:lPosition + lChunkSize], aBuffers[1][lPosition:lPosition + lChunkSize]
+                    lPosition += lChunkSize
+                aBuffers = [aBuffer[lPosition:] for aBuffer in aBuffers]
+            if aBuffers[0]:
+                queueTargets.append(aBuffers[2])
+                yield aBuffers[0], aBuffers[1]
+
+        for aChunkResults, dicAdditionalInformation in fnCallback(iter_chunks(), **dicCallbackParameters):
+            lChunkLength = min(lChunkSize, lNrOfPairs - lOffset)
+            if not queueTargets or len(aChunkResults) != lChunkLength:
+                raise Exception(
+                    "Array of Decisions of chunk at pair %i does not have the size of the chunk. Aborting." % lOffset)
+            aChunkTargets = np.asarray(queueTargets.popleft(), dtype=bool)
+            if aThresholds is None:
+                aChunkDecisions = _as_decisions(aChunkResults)[None, :]
+                aChunkCounts = np.array(calc_confusion_counts(
+                    aChunkDecisions[0], aChunkTargets))[:, None]
+            else:
+                aChunkDeviations = np.asarray(aChunkResults, dtype=np.float64)
+                aChunkCounts = np.array(calc_threshold_confusion_counts(
+                    aChunkDeviations, aChunkTargets, aThresholds))
+                aChunkDecisions = aChunkDeviations[None, :] <= aThresholds[:, None]
+            aCounts += aChunkCounts
+            aChunkDigests = []
+            if bStorePairResults:
+                aChunkDigests = [self._db.add_artifact_data(np.packbits(aChunkDecisions[i]))
+                                 for i in range(lNrOfTests)]
+                for i in range(lNrOfTests):
+                    aDecisionDigests[i].append(aChunkDigests[i])
+            if sFingerprint is not None:
+                self._db.add_checkpoint(sFingerprint, lOffset // lChunkSize,
+                                        {"counts": aChunkCounts, "digests": aChunkDigests,
+                                         "metadata": dicAdditionalInformation, "size": lChunkLength})
+            lOffset += lChunkLength
+
+        if lOffset != lNrOfPairs:
+            raise Exception(
+                "Array of Decisions is not the same size as given set of objects. Aborting.")
 
-        return dicTest
+        aTests = []
+        for i in range(lNrOfTests):
+            dicTest = dict(dicAdditionalInformation)
+            dicTest["challenge"] = sChallengeName
+            if aThresholds is not None:
+                dicTest["threshold"] = float(aThresholds[i])
+            dicTest["TP"], dicTest["TN"], dicTest["FP"], dicTest["FN"] = (
+                int(lCount) for lCount in aCounts[:, i])
+            dicTest.update(calc_metrics(
+                dicTest["TP"], dicTest["TN"], dicTest["FP"], dicTest["FN"]))
+            if bStorePairResults:
+                # the packed decisions of the chunks are referred to by their digests
+                dicTest[TEST_ARTIFACTS_KEY] = {"decisions": {"chunks": aDecisionDigests[i], "size": lNrOfPairs}}
+            aTests.append(dicTest)
+        return aTests if aThresholds is not None else aTests[0]
+
+    def save_tests(self, aTests, sFingerprint=None):
+        """ saves the tests of one run to the database in a single transaction
+
+        Note:
+            The tests are marked with sFingerprint and checkpoints stored under it are deleted, see is_test_completed.
+
+        Returns:
+            :obj:`list` of :obj:`int`: the ids of the saved tests
+        """
+        for dicTest in aTests:
+            if not dicTest:
+                raise Exception("Test object must not be None.")
+        return self._db.add_tests(aTests, sFingerprint)
+
+    def is_test_completed(self, sFingerprint):
+        """ returns True if the tests of the run with the given fingerprint have been saved"""
+        return self._db.has_test_fingerprint(sFingerprint)
 
     def __save_test(self, dicTest):
         """ saves a test object to the database"""
         if not dicTest:
             raise Exception("Test object must not be None.")
 
-        aTests = self._db.get(DB_TESTS_KEY, [])
-        aTests.append(dicTest)
-        self._db[DB_TESTS_KEY] = aTests
-        self._db.commit()
+        self._db.add_test(dicTest)
 
     def save_test_threadsafe(self, dicTest, lock):
         """ saves a test object to the database threadsafe"""
@@ -250,12 +471,101 @@ class Twizzle(object):
     def get_tests(self):
         """getting all tests
 
+        Note:
+            Every test object contains its database id under the key `test_id`.
+
         Returns:
             :obj:`list` of :obj:: `obj`:  List of all tests executed
         """
-        return self._db.get(DB_TESTS_KEY, [])
+        return self._db.get_tests()
+
+    def get_test_pair_results(self, lTestId):
+        """ getting the stored decision and deviation of every object pair of a test
+
+        Args:
+            lTestId (int): id of the test
+
+        Returns:
+            (aDecisions, aDeviations): boolean numpy array of the decisions and numpy array of the
+                                       deviations. Each of them is None if it was not stored with the test.
+        """
+        dicPackedDecisions = self.get_test_artifacts(
+            "decisions", lTestId).get(lTestId)
+        if dicPackedDecisions is not None and "chunks" in dicPackedDecisions:
+            # decisions of a streaming test, stored chunk by chunk
+            aPacked = [self._db.get_artifact_data(sDigest) for sDigest in dicPackedDecisions["chunks"]]
+            dicPackedDecisions = {"size": dicPackedDecisions["size"],
+                                  "packed": np.concatenate(aPacked) if aPacked else np.zeros(0, dtype=np.uint8)}
+        aDeviations = self.get_test_artifacts(
+            "deviations", lTestId).get(lTestId)
+        aDecisions = unpack_decisions(
+            dicPackedDecisions) if dicPackedDecisions is not None else None
+        return aDecisions, aDeviations
+
+    def recalc_test_metrics(self, lTestId):
+        """ calculates confusion counts and metrics of a test again from its stored decisions
+
+        Note:
+            The test has to be run with bStorePairResults and its challenge has to exist.
+
+        Args:
+            lTestId (int): id of the test
+
+        Returns:
+            :obj:: dictionary holding TP, TN, FP, FN and all metrics calculated by run_test
+        """
+        dicTest = self._db.get_test(lTestId)
+        if dicTest is None:
+            raise Exception("No test with id %s found." % lTestId)
+        aDecisions, _ = self.get_test_pair_results(lTestId)
+        if aDecisions is None:
+            raise Exception(
+                "Decisions of test %s have not been stored." % lTestId)
+        aTargetDecisions = self.get_challenge(
+            dicTest["challenge"])["targetDecisions"]
+        lTP, lTN, lFP, lFN = calc_confusion_counts(
+            aDecisions, aTargetDecisions)
+        dicMetrics = {"TP": lTP, "TN": lTN, "FP": lFP, "FN": lFN}
+        dicMetrics.update(calc_metrics(lTP, lTN, lFP, lFN))
+        return dicMetrics
+
+    def get_test_artifacts(self, sName, lTestId=None):
+        """ getting data saved next to the tests like the ROC curves of threshold sweeps
+
+        Note:
+            Artifacts are kept out of the test objects to keep get_tests lightweight.
+            Available artifacts:
+            - "roc": dictionary of the arrays `thresholds`, `FPR` and `TPR` of the ROC curve
+            - "decisions": bit-packed decisions of all object pairs (see get_test_pair_results), streaming
+                           tests only refer to the packed decisions of their chunks by digest
+            - "deviations": numpy array of the deviations of all object pairs
+
+        Args:
+            sName (str): name of the artifact
+            lTestId (int): optional id of a single test
+
+        Returns:
+            :obj:: dictionary mapping the ids of the tests to their artifact
+        """
+        return self._db.get_test_artifacts(sName, lTestId)
 
     def clear_tests(self):
         """ delete all tests from the database """
-        self._db[DB_TESTS_KEY] = []
-        self._db.commit()
+        self._db.clear_tests()
+
+    def import_sqlitedict_db(self, sPathToLegacyDB):
+        """ imports challenges and tests from a database written by an older version of Twizzle
+
+        Note:
+            Older versions kept all challenges and all tests as two pickled lists in a sqlitedict
+            database. Opening such a database directly with Twizzle migrates it in place, this
+            function copies the content of a legacy database into the current one instead.
+        Args:
+            sPathToLegacyDB (str): Path to the legacy sqlitedict database
+
+        Returns:
+            None
+        """
+        if not sPathToLegacyDB:
+            raise Exception("Path to legacy database has to be defined")
+        self._db.import_sqlitedict(sPathToLegacyDB)